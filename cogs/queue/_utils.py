@@ -1,5 +1,8 @@
 import discord
+from datetime import datetime, timedelta
+from typing import Optional
 from utils.general import is_user_authorized, create_embed
+from utils.globals import POST_HR_INTERVAL, cfg
 
 async def delete_response(interaction: discord.Interaction, bot_info: discord.AppInfo, post: dict, view: discord.ui.View):
 	"""
@@ -54,3 +57,50 @@ async def edit_response(interaction: discord.Interaction, bot_info: discord.AppI
 		)
 
 	return await interaction.response.send_modal(view(post = post))
+
+def create_post_embed(post: dict, position: int, base_timestamp: datetime, total: Optional[int] = None, retrying: int = 0):
+	"""
+	Creates the embed used to display a post within the queue
+
+	Args
+	----
+		- post (dict): The post to display
+		- position (int): The zero-based position of the post within the queue
+		- base_timestamp (datetime): When the post at the head of the queue will be posted
+		- total (Optional[int]): The total amount of posts in the queue, shown in the footer if given
+		- retrying (int): The amount of posts being retried that are listed ahead of the queue
+	"""
+
+	embed = discord.Embed(title = "Queue list", color=discord.Color.from_str(cfg.settings.discord.embed_colors.info))
+
+	caption = post.get('caption', '')
+	alt_text = post.get('alt_text', '')
+	catbox_url = post.get('catbox_url', '')
+	orig_url = post.get('original_url', '')
+	author = post.get('author', '')
+	emoji = post.get('emoji', '')
+
+	# Posts being retried go out alongside the next post, and don't hold up the rest of the queue
+	eta_position = 0 if post.get('retrying') else position - retrying
+	eta = int((base_timestamp + timedelta(hours = POST_HR_INTERVAL * eta_position)).timestamp())
+
+	if caption:
+		embed.add_field(name = "Caption", value = caption, inline = False)
+
+	embed.add_field(name = "Alt text", value = alt_text, inline = False)
+	embed.add_field(
+		name = "Author",
+		value = f"**<@{author}>** - {emoji}",
+		inline = False,
+	)
+	embed.add_field(name = "Gif URL", value = catbox_url, inline = False)
+	embed.add_field(name="ETA", value=f"<t:{eta}:R>", inline=False)
+
+	if post.get('retrying'):
+		embed.add_field(name = "Status", value = "Retrying the platforms it didn't go out to", inline = False)
+	embed.set_image(url = orig_url)
+
+	if total:
+		embed.set_footer(text = f"Post {position + 1} / {total}")
+
+	return embed
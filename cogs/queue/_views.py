@@ -1,5 +1,7 @@
 import discord
-from cogs.queue._utils import delete_response, edit_response
+from collections import OrderedDict
+from datetime import datetime
+from cogs.queue._utils import create_post_embed, delete_response, edit_response
 from utils.general import is_user_authorized, create_embed, remove_post, edit_post
 
 class EditPostModal(discord.ui.Modal):
@@ -40,10 +42,22 @@ class EditPostModal(discord.ui.Modal):
 
 	# Whenever the user submits the modal, update the post config and send a message
 	async def on_submit(self, interaction: discord.Interaction):
-		edit_post(self.post, {
+		edited = await edit_post(self.post, {
 			'caption': self.children[0].value,
 			'alt_text': self.children[1].value
 		})
+
+		# The post was either posted, deleted or edited by someone else while the modal was open
+		if not edited:
+			return await interaction.response.send_message(
+				embed=create_embed(
+					"Error",
+					"This post was changed or removed by someone else while you were editing it.\nPlease view the queue again and retry.",
+					'error'
+				),
+				ephemeral=True
+			)
+
 		await self.send_edit_message(interaction)
 
 	# Send a message to the user letting them know the post has been edited
@@ -80,7 +94,15 @@ class DeleteConfirmation(discord.ui.View):
 				ephemeral=True,
 			)
 
-		remove_post(self.post)
+		if not await remove_post(self.post):
+			return await interaction.response.send_message(
+				embed=create_embed(
+					"Error",
+					"This post is no longer in the queue.",
+					'error'
+				),
+				ephemeral=True
+			)
 
 		return await interaction.response.send_message(
 			embed=create_embed(
@@ -148,27 +170,133 @@ class AuthedQueueViewBasic(discord.ui.View):
 	):
 		return await edit_response(interaction, self.bot_info, self.post, EditPostModal)
 
+class JumpToPageModal(discord.ui.Modal):
+	"""
+	Modal to jump to a given page of the queue
+
+	Args
+	----
+		- view (AuthedQueueViewExtended): The view to change the page of
+		- title (Optional[str]): The title of the modal
+	"""
+
+	def __init__(self, view, title="Jump to page"):
+		super().__init__(title=title)
+		self.view = view
+		self.add_item(
+			discord.ui.TextInput(
+				label=f"Page (1 - {len(view.posts)})",
+				default=str(view.current_page + 1),
+				max_length=10,
+			)
+		)
+
+	# Whenever the user submits the modal, swap the view over to the given page
+	async def on_submit(self, interaction: discord.Interaction):
+		value = self.children[0].value.strip()
+
+		if not value.isdigit() or not 1 <= int(value) <= len(self.view.posts):
+			return await interaction.response.send_message(
+				embed=create_embed(
+					"Error",
+					f"Please enter a page number between 1 and {len(self.view.posts)}.",
+					'error'
+				),
+				ephemeral=True
+			)
+
+		await self.view.show_page(interaction, int(value) - 1)
+
 class AuthedQueueViewExtended(discord.ui.View):
 	"""
-	Authed queue viewing (extended, comes with previous and next buttons)
+	Authed queue viewing (extended, comes with page navigation buttons)
+
+	Pages are only rendered once they're navigated to, and the most recently rendered ones are
+	kept around so that flicking back and forth doesn't rebuild them.
 
 	Args
 	----
-		- pages (list): The pages to view
-			- These are formatted as a list of objects, which contain both the post object and the embed associated with it
+		- posts (list): A snapshot of the queue to page through
 		- bot_info (discord.AppInfo): The bot's application info
+		- base_timestamp (datetime): When the post at the head of the queue will be posted
 	"""
 
+	# The amount of rendered pages to keep around
+	PAGE_CACHE_SIZE = 8
+
 	def __init__(
 		self,
-		pages: list,
-		bot_info
+		posts: list,
+		bot_info,
+		base_timestamp: datetime
 	):
 		super().__init__()
-		self.pages = pages
-		self.post = self.pages[0]["post"]
+		self.posts = posts
 		self.bot_info = bot_info
+		self.base_timestamp = base_timestamp
+		self.retrying = len([post for post in posts if post.get('retrying')])
 		self.current_page = 0
+		self.post = self.posts[0]
+		self.rendered_pages = OrderedDict()
+		self.update_buttons()
+
+	def render_page(self, page: int) -> discord.Embed:
+		"""
+		Returns the embed for the given page, rendering it if it isn't cached
+
+		Args
+		----
+			- page (int): The zero-based page to render
+		"""
+
+		post = self.posts[page]
+
+		# posts edited through this view are updated in place, so the version tells us if a page is stale
+		cached = self.rendered_pages.get(page)
+		if cached and cached[0] == post.get('version'):
+			self.rendered_pages.move_to_end(page)
+			return cached[1]
+
+		embed = create_post_embed(post, page, self.base_timestamp, len(self.posts), self.retrying)
+		self.rendered_pages[page] = (post.get('version'), embed)
+		self.rendered_pages.move_to_end(page)
+
+		if len(self.rendered_pages) > self.PAGE_CACHE_SIZE:
+			self.rendered_pages.popitem(last = False)
+
+		return embed
+
+	def update_buttons(self):
+		"""
+		Enables or disables the navigation buttons depending on the current page
+		"""
+
+		is_first = self.current_page == 0
+		is_last = self.current_page == len(self.posts) - 1
+
+		self.first.disabled = is_first
+		self.previous.disabled = is_first
+		self.next.disabled = is_last
+		self.last.disabled = is_last
+
+	async def show_page(self, interaction: discord.Interaction, page: int):
+		"""
+		Swaps the message over to the given page
+
+		Args
+		----
+			- interaction (discord.Interaction): The interaction to respond to
+			- page (int): The zero-based page to show
+		"""
+
+		self.current_page = max(0, min(page, len(self.posts) - 1))
+		self.post = self.posts[self.current_page]
+		self.update_buttons()
+
+		await interaction.response.edit_message(
+			embed = self.render_page(self.current_page),
+			view = self
+		)
 
 	@discord.ui.button(label = "Delete", style = discord.ButtonStyle.red)
 	async def delete(
@@ -183,41 +311,22 @@ class AuthedQueueViewExtended(discord.ui.View):
 	async def edit(self, interaction: discord.Interaction, _):
 		return await edit_response(interaction, self.bot_info, self.post, EditPostModal)
 
-	@discord.ui.button(label = "Previous", style = discord.ButtonStyle.grey, disabled = True)
-	async def previous(
-		self,
-		interaction: discord.Interaction,
-		_
-	):
-		self.current_page -=  1
+	@discord.ui.button(label = "Jump to page", style = discord.ButtonStyle.grey)
+	async def jump(self, interaction: discord.Interaction, _):
+		return await interaction.response.send_modal(JumpToPageModal(self))
 
-		for child in self.children:
-			child.disabled = child.label == "Previous" if self.current_page == 0 else False
+	@discord.ui.button(label = "First", style = discord.ButtonStyle.grey, row = 1)
+	async def first(self, interaction: discord.Interaction, _):
+		await self.show_page(interaction, 0)
 
-		self.post = self.pages[self.current_page]["post"]
-		embed = self.pages[self.current_page]["embed"]
-		await interaction.response.edit_message(
-			embed = embed,
-			view = self
-		)
-
-	@discord.ui.button(label = "Next", style = discord.ButtonStyle.grey)
-	async def next(
-		self,
-		interaction: discord.Interaction,
-		_
-	):
-		self.current_page += 1
+	@discord.ui.button(label = "Previous", style = discord.ButtonStyle.grey, row = 1)
+	async def previous(self, interaction: discord.Interaction, _):
+		await self.show_page(interaction, self.current_page - 1)
 
-		for child in self.children:
-			if self.current_page == len(self.pages) - 1:
-				child.disabled = child.label == "Next"
-			else:
-				child.disabled = False
+	@discord.ui.button(label = "Next", style = discord.ButtonStyle.grey, row = 1)
+	async def next(self, interaction: discord.Interaction, _):
+		await self.show_page(interaction, self.current_page + 1)
 
-		self.post = self.pages[self.current_page]["post"]
-		embed = self.pages[self.current_page]["embed"]
-		await interaction.response.edit_message(
-			embed = embed,
-			view = self
-		)
\ No newline at end of file
+	@discord.ui.button(label = "Last", style = discord.ButtonStyle.grey, row = 1)
+	async def last(self, interaction: discord.Interaction, _):
+		await self.show_page(interaction, len(self.posts) - 1)
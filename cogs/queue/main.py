@@ -1,9 +1,10 @@
 import discord
 from discord.ext import commands
+from cogs.queue._utils import create_post_embed
 from cogs.queue._views import AuthedQueueViewBasic, AuthedQueueViewExtended
 from utils.general import error_response, handle_base_response, is_user_authorized
-from utils.globals import POST_HR_INTERVAL, cfg
-from datetime import datetime, timedelta
+from utils.globals import cfg, post_queue
+from datetime import datetime
 
 class Queue(commands.Cog):
 	def __init__(self, bot: commands.Bot):
@@ -14,7 +15,8 @@ class Queue(commands.Cog):
 	@group.command(name = 'view', description = 'View the post queue.')
 	async def queue_view(self, interaction: discord.Interaction):
 		bot_info = await self.bot.application_info()
-		queue = cfg.get('queue')
+		# Posts being retried on the platforms they didn't go out to are listed first, as they're retried next cycle
+		queue = post_queue.retries() + post_queue.all()
 		queue_length = len(queue)
 
 		# If queue is empty, return
@@ -26,32 +28,12 @@ class Queue(commands.Cog):
 			)
 
 
+		base_timestamp = datetime.fromtimestamp(cfg.settings.next_post_time)
+
 		# If there is only one post in the queue, return an embed with only delete/edit buttons
 		if queue_length == 1:
-			embed = discord.Embed(title = "Queue list", color=discord.Color.from_str(cfg.get('discord.embed_colors.info')))
-
 			post = queue[0]
-			caption = post.get('caption', '')
-			alt_text = post.get('alt_text', '')
-			catbox_url = post.get('catbox_url', '')
-			orig_url = post.get('original_url', '')
-			author = post.get('author', '')
-			emoji = post.get('emoji', '')
-			base_timestamp = datetime.fromtimestamp(int(cfg.get('next_post_time')))
-
-			# add caption field if present
-			if caption != "":
-				embed.add_field(name = "Caption", value = caption, inline = False)
-
-			embed.add_field(name = "Alt text", value = alt_text, inline = False)
-			embed.add_field(
-				name = "Author",
-				value = f"**<@{author}>** - {emoji}",
-				inline = False,
-			)
-			embed.add_field(name = "Gif URL", value = catbox_url)
-			embed.add_field(name="ETA", value=f"<t:{int(base_timestamp.timestamp())}:R>", inline=False)
-			embed.set_image(url = orig_url)
+			embed = create_post_embed(post, 0, base_timestamp)
 
 			if interaction.response.is_done():
 				return await interaction.edit_original_response(embed = embed, view=AuthedQueueViewBasic(post, bot_info))
@@ -60,44 +42,14 @@ class Queue(commands.Cog):
 
 
 		# If there are multiple posts in the queue, return an embed with multiple pages, and edit/delete buttons
-		if queue_length > 1:
-			embeds = []
-			base_timestamp = datetime.fromtimestamp(int(cfg.get('next_post_time')))
-
-			for count, post in enumerate(queue, start=1):
-				embed = discord.Embed(title = "Queue list", color=discord.Color.from_str(cfg.get('discord.embed_colors.info')))
-
-				caption = post.get('caption', '')
-				alt_text = post.get('alt_text', '')
-				catbox_url = post.get('catbox_url', '')
-				orig_url = post.get('original_url', '')
-				author = post.get('author', '')
-				emoji = post.get('emoji', '')
-				eta = int((base_timestamp + timedelta(hours = POST_HR_INTERVAL * (count - 1))).timestamp())
-
-				if caption:
-					embed.add_field(name = "Caption", value = caption, inline = False)
-
-				embed.add_field(name = "Alt text", value = alt_text, inline = False)
-				embed.add_field(
-					name = "Author",
-					value = f"**<@{author}>** - {emoji}",
-					inline = False,
-				)
-				embed.add_field(name = "Gif URL", value = catbox_url, inline = False)
-				embed.add_field(name="ETA", value=f"<t:{eta}:R>", inline=False)
-				embed.set_image(url = orig_url)
-				embed.set_footer(text = f"Post {count} / {queue_length}")
-
-				embeds.append({
-					"embed": embed,
-					"post": post
-				})
+		# Only the first page is rendered here, the rest are rendered as they're navigated to
+		view = AuthedQueueViewExtended(queue, bot_info, base_timestamp)
+		embed = view.render_page(0)
 
-			if interaction.response.is_done():
-				return await interaction.edit_original_response(embed = embeds[0]['embed'], view=AuthedQueueViewExtended(embeds, bot_info))
-			else:
-				return await interaction.response.send_message(embed = embeds[0]['embed'], view=AuthedQueueViewExtended(embeds, bot_info))
+		if interaction.response.is_done():
+			return await interaction.edit_original_response(embed = embed, view = view)
+		else:
+			return await interaction.response.send_message(embed = embed, view = view)
 
 	@queue_view.error
 	async def queue_view_error(self, interaction: discord.Interaction, error):
@@ -106,8 +58,7 @@ class Queue(commands.Cog):
 
 	@group.command(name = 'remove', description = "Remove an item from the queue")
 	async def queue_remove(self, interaction: discord.Interaction, url: str):
-		queue = cfg.get('queue')
-		queue_length = len(queue)
+		queue_length = len(post_queue) + len(post_queue.retries())
 		bot_info = await self.bot.application_info()
 
 
@@ -130,13 +81,7 @@ class Queue(commands.Cog):
 
 
 		# Find the post in the queue given the URL
-		foundGif = False
-		for post in queue.copy():
-			if post["catbox_url"] == url or post["original_url"] == url:
-				queue.remove(post)
-				foundGif = True
-
-		cfg.set('queue', queue)
+		foundGif = await post_queue.remove_by_url(url)
 
 
 		if foundGif:
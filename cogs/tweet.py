@@ -1,13 +1,21 @@
+import asyncio
+import csv
+import io
 import re
+import time
+import traceback
 import discord
+import httpx
 from discord.ext import commands
 from datetime import datetime, timedelta
-from typing import Optional, Union
+from typing import Optional, Tuple, Union
 from httpx import AsyncClient
 from cogs.queue._views import AuthedQueueViewBasic
 from utils.config import deep_merge
 from utils.general import is_user_authorized, create_embed, handle_base_response, error_response
-from utils.globals import ALT_TENOR_REGEX, cfg, POST_HR_INTERVAL, BASE_HEADERS, CATBOX_URL, CLEAN_URL_REGEX, GIF_SIZE_LIMIT, TENOR_REGEX
+from utils.http import FileTooLargeError
+from utils.ingest import IngestJob, StageTimeoutError
+from utils.globals import ALT_TENOR_REGEX, cfg, http_manager, ingest_pool, post_queue, POST_HR_INTERVAL, BASE_HEADERS, BULK_CONCURRENCY, BULK_MAX_ITEMS, CATBOX_UPLOAD_TIMEOUT, CATBOX_URL, CLEAN_URL_REGEX, GIF_SIZE_LIMIT, TENOR_REGEX, log
 
 class Tweet(commands.Cog):
 	def __init__(self, bot: commands.Bot):
@@ -26,13 +34,12 @@ class Tweet(commands.Cog):
 		alt_text: str,
 		caption: Optional[str] = "",
 	):
-		client = AsyncClient()
+		client = http_manager.client
 		bot_info = await self.bot.application_info()
 
 
-		emojis = cfg.get('discord.emojis')
-		queue = cfg.get('queue')
-		userhash = cfg.get('userhash')
+		emojis = cfg.settings.discord.emojis
+		userhash = cfg.settings.userhash
 
 
 		# Check if the user is authorized to run this command
@@ -67,42 +74,9 @@ class Tweet(commands.Cog):
 		)
 
 
-		# Return a response in <= 3 seconds to prevent the command from erroring
-		await handle_base_response(
-			interaction = interaction,
-			responseType = "info",
-			content = "Determining if the gif is valid...",
-		)
-
-
-		# Determine the real url of the gif, depending
-		url = await self.find_real_url(url)
-		if not url:
-			return await handle_base_response(
-				interaction = interaction,
-				responseType = "error",
-				content = "Either a GIF was unable to be found from the link provided, or you have provided a link that is currently not supported.\nPlease note that at the moment we only support Tenor, Giphy, and any other URL that ends in .gif.",
-			)
-
-
-		# Check to see if the gif is already in the queue
-		for post in queue:
-			if post["original_url"] == url:
-				return await handle_base_response(
-					interaction = interaction,
-					responseType = "error",
-					content = "The URL you entered is already in the queue.",
-				)
-
-
-		# Check to see if the gif is too large
-		is_small_enough = await self.check_file_size(url)
-		if not is_small_enough:
-			return await handle_base_response(
-				interaction = interaction,
-				responseType = "error",
-				content = "The gif you uploaded is too large. Please compress your file to below 10MB in size, and try again.",
-			)
+		# Acknowledge the interaction straight away to prevent the command from erroring
+		# The gif is processed in the background, and the response is edited as each stage finishes
+		await interaction.response.defer(thinking = True)
 
 
 		# If userhash field is not in config, return error
@@ -116,38 +90,48 @@ class Tweet(commands.Cog):
 			)
 
 
-		# Upload the file to catbox.moe
-		res = await client.post(
-			url = CATBOX_URL,
-			headers = BASE_HEADERS,
-			data = {
-				"reqtype": "urlupload",
-				"userhash": userhash,
-				"url": url,
-			}
-		)
+		async def report_progress(description: str):
+			await handle_base_response(
+				interaction = interaction,
+				responseType = "info",
+				content = description,
+			)
 
 
-		# Check to see if the upload was successful
-		if res.status_code != 200 or "Something went wrong" in res.text:
+		# Resolve, validate and upload the gif to catbox.moe on the ingestion pool
+		if ingest_pool.waiting:
+			await report_progress(f"Waiting for {ingest_pool.waiting} other gif(s) to finish processing...")
+
+		result, error = await ingest_pool.submit(self.process_url, client, url, userhash, progress = report_progress)
+		if error:
 			return await handle_base_response(
 				interaction = interaction,
 				responseType = "error",
-				content = "An error occurred while uploading your gif to catbox.moe. Please try again later.",
+				content = error,
 			)
 
+		url = result["original_url"]
+
 
 		# Add the post to the queue
-		post = {
+		post = await post_queue.enqueue({
 			"original_url": url,
-			"catbox_url": res.text,
+			"catbox_url": result["catbox_url"],
 			"author": str(interaction.user.id),
 			"emoji": emoji,
 			"caption": caption,
 			"alt_text": alt_text,
-		}
-		queue.append(post)
-		cfg.set('queue', queue)
+		})
+
+		if not post:
+			# It was queued by someone else while this one was uploading, so the upload isn't needed
+			await self.delete_from_catbox(client, result["catbox_url"], userhash)
+
+			return await handle_base_response(
+				interaction = interaction,
+				responseType = "error",
+				content = "The URL you entered is already in the queue.",
+			)
 
 
 		# Return a success message
@@ -161,12 +145,12 @@ class Tweet(commands.Cog):
 			embed.add_field(name = "Caption", value = caption, inline = False)
 
 		embed.add_field(name = "Alt Text", value = alt_text, inline = False)
-		embed.add_field(name = "Gif URL", value = res.text, inline = False)
+		embed.add_field(name = "Gif URL", value = result["catbox_url"], inline = False)
 		embed.set_image(url = url)
 
 		# Finding the eta
-		base_timestamp = datetime.fromtimestamp(int(cfg.get('next_post_time')))
-		eta = int((base_timestamp + timedelta(hours = POST_HR_INTERVAL * (len(queue) - 1))).timestamp())
+		base_timestamp = datetime.fromtimestamp(cfg.settings.next_post_time)
+		eta = int((base_timestamp + timedelta(hours = POST_HR_INTERVAL * post_queue.position(post['id']))).timestamp())
 		embed.add_field(name = "ETA", value = f"<t:{eta}:R>", inline = False)
 
 
@@ -175,16 +159,430 @@ class Tweet(commands.Cog):
 		else:
 			await interaction.response.send_message(embed = embed, view = AuthedQueueViewBasic(post, bot_info))
 
-		await client.aclose()
-
 
 	@tweet.error
 	async def tweet_error(self, interaction: discord.Interaction, error):
 		await error_response(interaction, error, '/tweet')
 
 
+	@discord.app_commands.command(name = "tweet_bulk", description = "Add multiple gifs to the queue at once")
+	@discord.app_commands.describe(
+		urls = "The URLs of the gifs you want to queue, separated by spaces, commas or new lines",
+		file = "A text or CSV file with one gif per line, formatted as: url, alt text, caption",
+		alt_text = "The alt text to use for any gif that doesn't have its own",
+		caption = "The caption to use for any gif that doesn't have its own",
+	)
+	async def tweet_bulk(
+		self,
+		interaction: discord.Interaction,
+		urls: Optional[str] = "",
+		file: Optional[discord.Attachment] = None,
+		alt_text: Optional[str] = "",
+		caption: Optional[str] = "",
+	):
+		bot_info = await self.bot.application_info()
+
+
+		emojis = cfg.settings.discord.emojis
+		userhash = cfg.settings.userhash
+
+
+		# Check if the user is authorized to run this command
+		if not is_user_authorized(interaction.user.id, bot_info):
+			return await interaction.response.send_message(
+				embed = create_embed(
+					"Error",
+					"You do not have permission to run this command.\nPlease ask an administrator for access if you believe this to be in error.",
+					'error'
+				),
+				ephemeral = True
+			)
+
+
+		# Check to see if the user has an emoji set (required to post)
+		if str(interaction.user.id) not in emojis:
+			return await interaction.response.send_message(
+				embed = create_embed(
+					"Error",
+					"You do not have an emoji set.\nPlease set an emoji with `/emoji set `.",
+					'error'
+				),
+				ephemeral = True
+			)
+
+
+		# If userhash field is not in config, return error
+		if not userhash:
+			return await handle_base_response(
+				interaction = interaction,
+				responseType = "error",
+				content = "The bot owner has not set the `user_hash` property for uploads to [catbox](https://catbox.moe).",
+			)
+
+
+		# Decode the users emoji into an acceptable format
+		emoji = (
+			emojis[str(interaction.user.id)]
+			.encode("utf-16", "surrogatepass")
+			.decode("utf-16")
+		)
+
+
+		# Gather every gif from the urls and the attached file
+		items = [{"url": url, "alt_text": alt_text, "caption": caption} for url in re.split(r"[\s,]+", urls or "") if url]
+
+		if file:
+			try:
+				contents = (await file.read()).decode("utf-8-sig")
+			except UnicodeDecodeError:
+				return await handle_base_response(
+					interaction = interaction,
+					responseType = "error",
+					content = "The file you attached is not a valid text or CSV file.",
+				)
+
+			for row in csv.reader(io.StringIO(contents)):
+				row = [column.strip() for column in row]
+				if not row or not row[0]:
+					continue
+
+				items.append({
+					"url": row[0],
+					"alt_text": row[1] if len(row) > 1 and row[1] else alt_text,
+					"caption": row[2] if len(row) > 2 and row[2] else caption,
+				})
+
+
+		# Drop any gifs that were given more than once
+		unique_items = {}
+		for item in items:
+			unique_items.setdefault(item["url"], item)
+
+		items = list(unique_items.values())
+
+		if len(items) == 0:
+			return await handle_base_response(
+				interaction = interaction,
+				responseType = "error",
+				content = "Please provide at least one URL, either directly or through an attached file.",
+			)
+
+		if len(items) > BULK_MAX_ITEMS:
+			return await handle_base_response(
+				interaction = interaction,
+				responseType = "error",
+				content = f"You can only queue up to {BULK_MAX_ITEMS} gifs at once (you provided {len(items)}).",
+			)
+
+
+		# Return a response in <= 3 seconds to prevent the command from erroring
+		for item in items:
+			item["status"] = "⏳ Waiting..."
+
+		await handle_base_response(
+			interaction = interaction,
+			responseType = "info",
+			content = self.format_bulk_progress(items),
+		)
+
+
+		# Process every gif across a bounded pool of workers, editing the response as each one finishes
+		client = http_manager.client
+		semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+		progress = {"last_edit": time.monotonic()}
+
+		async def update_progress(force: bool = False):
+			# Interaction edits are rate limited, so don't send them more often than we need to
+			if not force and time.monotonic() - progress["last_edit"] < 1.5:
+				return
+
+			progress["last_edit"] = time.monotonic()
+
+			# A failed edit only means the progress is out of date for a moment, so it shouldn't stop the upload
+			try:
+				await interaction.edit_original_response(
+					embed = create_embed("Info", self.format_bulk_progress(items), "info")
+				)
+			except discord.HTTPException:
+				log.warning(f"Unable to update the progress of a bulk upload\n{traceback.format_exc()}")
+
+		async def worker(item: dict):
+			async with semaphore:
+				if not item["alt_text"]:
+					item["status"] = "❌ No alt text was provided."
+					return
+
+				async def report_progress(description: str):
+					item["status"] = f"🔄 {description}"
+					await update_progress()
+
+				item["status"] = "🔄 Processing..."
+
+				# One bad link shouldn't take down the rest of the upload, so any error only fails its own gif
+				try:
+					result, error = await ingest_pool.submit(self.process_url, client, item["url"], userhash, progress = report_progress)
+				except Exception:
+					log.error(f"An error occurred while processing {item['url']}\n{traceback.format_exc()}")
+					result, error = None, "An error occurred while processing the gif."
+
+				if error:
+					item["status"] = f"❌ {error.splitlines()[0]}"
+				else:
+					item.update(result)
+					item["status"] = "✅ Ready"
+
+			await update_progress()
+
+		await asyncio.gather(*[worker(item) for item in items])
+
+
+		# Commit every accepted gif to the queue in a single write
+		accepted = [item for item in items if "catbox_url" in item]
+		queued = await post_queue.enqueue_many([
+			{
+				"original_url": item["original_url"],
+				"catbox_url": item["catbox_url"],
+				"author": str(interaction.user.id),
+				"emoji": emoji,
+				"caption": item["caption"],
+				"alt_text": item["alt_text"],
+			}
+			for item in accepted
+		])
+
+		# Every accepted gif has its own catbox URL, so this tells apart two links that resolved to the same gif
+		queued_urls = {post["catbox_url"] for post in queued}
+		for item in accepted:
+			if item["catbox_url"] in queued_urls:
+				item["status"] = "✅ Queued"
+			else:
+				item["status"] = "❌ Already in the queue."
+
+		# Anything the queue turned away doesn't need its upload anymore
+		await asyncio.gather(*[
+			self.delete_from_catbox(client, item["catbox_url"], userhash)
+			for item in accepted
+			if item["catbox_url"] not in queued_urls
+		])
+
+
+		# Return a summary of what was queued
+		embed = create_embed(
+			"Success" if queued else "Error",
+			self.format_bulk_progress(items),
+			"success" if queued else "error",
+		)
+		embed.add_field(name = "Queued", value = f"{len(queued)} / {len(items)}", inline = False)
+
+		await interaction.edit_original_response(embed = embed)
+
+
+	@tweet_bulk.error
+	async def tweet_bulk_error(self, interaction: discord.Interaction, error):
+		await error_response(interaction, error, '/tweet_bulk')
+
+
+	def format_bulk_progress(self, items: list, limit: int = 4096) -> str:
+		"""
+		Formats the status of every gif within a bulk upload, one per line
+
+		Long statuses are shortened, and if the lines still don't fit within the limit (Discord's embed
+		description limit by default), the rest are summarised at the end.
+
+		Args
+		----
+			- items (list): The gifs being uploaded
+			- limit (int): The maximum length of the formatted text
+		"""
+
+		lines = []
+		for count, item in enumerate(items, start = 1):
+			url = item["url"] if len(item["url"]) <= 48 else item["url"][:45] + "..."
+			status = item["status"] if len(item["status"]) <= 64 else item["status"][:61] + "..."
+			lines.append(f"`{count}.` {status} - <{url}>")
+
+		text = ""
+		for count, line in enumerate(lines):
+			# Leave room to summarise whatever doesn't fit, unless this is the last line
+			summary = f"\n...and {len(lines) - count} more"
+			reserve = len(summary) if count != len(lines) - 1 else 0
+
+			if len(text) + len(line) + 1 + reserve > limit:
+				return text + summary
+
+			text += ("\n" if text else "") + line
+
+		return text
+
+
+	async def process_url(self, job: IngestJob, client: AsyncClient, url: str, userhash: str) -> Tuple[Optional[dict], Optional[str]]:
+		"""
+		Resolves, validates and uploads a single gif to catbox.moe
+
+		This is run on the ingestion pool, with each stage reported through the job and given its own timeout
+
+		Args
+		----
+			- job (IngestJob): The ingestion job this is being run as
+			- client (AsyncClient): The HTTP client to upload with
+			- url (str): The URL of the gif, as given by the user
+			- userhash (str): The catbox.moe userhash to upload with
+
+		Returns
+		----
+			- Tuple[Optional[dict], Optional[str]]: The resolved `original_url` and `catbox_url`, or an error message
+		"""
+
+		try:
+			return await self.run_stages(job, client, url, userhash)
+		except StageTimeoutError as error:
+			return None, f"{error.stage} took too long. Please try again later."
+		except httpx.TimeoutException:
+			return None, "A request timed out while processing your gif. Please try again later."
+
+
+	async def run_stages(self, job: IngestJob, client: AsyncClient, url: str, userhash: str) -> Tuple[Optional[dict], Optional[str]]:
+		# Determine the real url of the gif, depending
+		url = await job.stage("Finding the gif...", self.find_real_url(url))
+		if not url:
+			return None, "Either a GIF was unable to be found from the link provided, or you have provided a link that is currently not supported.\nPlease note that at the moment we only support Tenor, Giphy, and any other URL that ends in .gif."
+
+
+		# Check to see if the gif is already in the queue
+		# This is only an in-memory lookup, so it's done straight away rather than alongside the network checks
+		if post_queue.find_by_url(url):
+			return None, "The URL you entered is already in the queue."
+
+
+		# Ask the server how large the gif is first, as it's cheap and means nothing is uploaded if it's too large
+		size = await job.stage("Checking the size of the gif...", self.probe_file_size(url))
+		if size is not None and size > GIF_SIZE_LIMIT:
+			return None, "The gif you uploaded is too large. Please compress your file to below 10MB in size, and try again."
+
+
+		# Upload the file to catbox.moe
+		upload = asyncio.create_task(job.stage(
+			"Uploading the gif to catbox.moe",
+			self.upload_to_catbox(client, url, userhash),
+			timeout = CATBOX_UPLOAD_TIMEOUT,
+			report = False,
+		))
+
+		if size is None:
+			# The server didn't say how large the gif is, so it's streamed (without keeping it) to find out
+			# The upload runs alongside it, and whatever it uploaded is deleted again if the gif turns out to be too large
+			await job.report("Checking the size of the gif and uploading it to catbox.moe...")
+
+			try:
+				is_small_enough = await job.stage("Checking the size of the gif", self.stream_file_size(url), report = False)
+			except asyncio.CancelledError:
+				# the bot is shutting down, so there's nothing left to wait on the upload with
+				upload.cancel()
+				raise
+			except Exception:
+				await self.discard_upload(client, upload, userhash)
+				raise
+
+			if not is_small_enough:
+				await self.discard_upload(client, upload, userhash)
+				return None, "The gif you uploaded is too large. Please compress your file to below 10MB in size, and try again."
+		else:
+			await job.report("Uploading the gif to catbox.moe...")
+
+
+		# Wait for the upload to finish
+		catbox_url = await upload
+		if not catbox_url:
+			return None, "An error occurred while uploading your gif to catbox.moe. Please try again later."
+
+		return {"original_url": url, "catbox_url": catbox_url}, None
+
+
+	async def upload_to_catbox(self, client: AsyncClient, url: str, userhash: str) -> Optional[str]:
+		"""
+		Uploads a gif to catbox.moe from its URL
+
+		Args
+		----
+			- client (AsyncClient): The HTTP client to upload with
+			- url (str): The URL of the gif
+			- userhash (str): The catbox.moe userhash to upload with
+
+		Returns
+		----
+			- Optional[str]: The catbox.moe URL of the gif, or None if the upload failed
+		"""
+
+		res = await client.post(
+			url = CATBOX_URL,
+			headers = BASE_HEADERS,
+			timeout = CATBOX_UPLOAD_TIMEOUT,
+			data = {
+				"reqtype": "urlupload",
+				"userhash": userhash,
+				"url": url,
+			}
+		)
+
+		# Check to see if the upload was successful
+		if res.status_code != 200 or "Something went wrong" in res.text:
+			return None
+
+		return res.text
+
+
+	async def discard_upload(self, client: AsyncClient, upload: asyncio.Task, userhash: str) -> None:
+		"""
+		Throws away a speculative catbox.moe upload once its gif has been rejected
+
+		The upload isn't cancelled, as catbox carries on fetching the gif on its end regardless. Instead
+		it's waited on, and whatever it uploaded is deleted.
+
+		Args
+		----
+			- client (AsyncClient): The HTTP client to delete the file with
+			- upload (asyncio.Task): The upload task
+			- userhash (str): The catbox.moe userhash the file was uploaded with
+		"""
+
+		try:
+			catbox_url = await upload
+		except Exception:
+			return
+
+		if catbox_url:
+			await self.delete_from_catbox(client, catbox_url, userhash)
+
+
+	async def delete_from_catbox(self, client: AsyncClient, catbox_url: str, userhash: str) -> None:
+		"""
+		Deletes a file that was uploaded to catbox.moe, i.e when its gif was rejected from the queue
+
+		Args
+		----
+			- client (AsyncClient): The HTTP client to delete the file with
+			- catbox_url (str): The catbox.moe URL of the file
+			- userhash (str): The catbox.moe userhash the file was uploaded with
+		"""
+
+		# The file is named after the last part of its URL, i.e `abc123.gif`
+		try:
+			res = await client.post(
+				url = CATBOX_URL,
+				headers = BASE_HEADERS,
+				data = {
+					"reqtype": "deletefiles",
+					"userhash": userhash,
+					"files": catbox_url.strip().rsplit("/", 1)[-1],
+				}
+			)
+			res.raise_for_status()
+		except httpx.HTTPError:
+			log.warning(f"Unable to delete {catbox_url} from catbox.moe\n{traceback.format_exc()}")
+
+
 	async def find_real_url(self, url: str) -> Union[str, None]:
-		client = AsyncClient()
+		client = http_manager.client
 		clean_url = re.sub(CLEAN_URL_REGEX, "", url)
 
 		if clean_url.startswith("https://tenor.com/view"):
@@ -193,39 +591,46 @@ class Tweet(commands.Cog):
 
 			res = await client.get(media_tenor_url, headers = deep_merge(BASE_HEADERS, {"Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8, image/jxl"}))
 			tmp_url = re.search(ALT_TENOR_REGEX, res.text).group(0)
-			await client.aclose()
 			return tmp_url
 		elif clean_url.startswith("https://giphy.com/gifs/"):
 			res = await client.get(url)
 			tmp_url = res.text.split('property = "og:image" content = "')[1].split('"')[0]
 
-			await client.aclose()
 			return None if tmp_url == "https://giphy.com/static/img/giphy-be-animated-logo.gif" else tmp_url
 		elif clean_url.endswith('.gif'):
-			await client.aclose()
 			return url
 		else:
-			await client.aclose()
 			return None
 
-	async def check_file_size(self, url: str) -> bool:
-		client = AsyncClient()
+	async def probe_file_size(self, url: str) -> Optional[int]:
+		"""
+		Asks the server how large a gif is, without downloading it
+
+		Returns
+		----
+			- Optional[int]: The size of the gif in bytes, or None if the server didn't say
+		"""
+
+		client = http_manager.client
 		res = await client.head(url, headers = BASE_HEADERS, timeout = 30)
-		content_length_header = None
 
-		for header in res.headers:
-			if header.lower() == "content-length":
-				content_length_header = header
-				break
+		for header, value in res.headers.items():
+			if header.lower() == "content-length" and value.isdigit():
+				return int(value)
+
+		return None
 
-		if not content_length_header:
-			new_res = await client.get(url, headers = BASE_HEADERS, timeout = 30)
-			await client.aclose()
-			return True if int(len(new_res.content)) <= GIF_SIZE_LIMIT else False
+	async def stream_file_size(self, url: str) -> bool:
+		"""
+		Streams a gif (without keeping it) until we know whether or not it's small enough, for servers that don't say how large it is
+		"""
 
-		await client.aclose()
-		return True if int(res.headers[content_length_header]) <= GIF_SIZE_LIMIT else False
+		try:
+			await http_manager.download(url, limit = GIF_SIZE_LIMIT, headers = BASE_HEADERS)
+		except FileTooLargeError:
+			return False
 
+		return True
 
 async def setup(bot: commands.Bot):
 	await bot.add_cog(Tweet(bot))
\ No newline at end of file
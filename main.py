@@ -1,25 +1,25 @@
 import asyncio
-import shutil
 import discord
 import os
 import traceback
-import random
-import string
-import threading
-import aiohttp
 from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Union
 from discord.ext import commands, tasks
-from httpx import AsyncClient, Response
 from modules import post_twitter, post_mastodon, post_tumblr
-from utils.globals import BASE_HEADERS, POST_HR_INTERVAL, POST_WB_INFO, MISC_WB_INFO, cfg, log
+from utils.delivery import Delivery
+from utils.http import FileTooLargeError
+from utils.scheduler import DeferredError
+from utils.globals import GIF_SIZE_LIMIT, MAX_DELIVERY_ATTEMPTS, MAX_DELIVERY_DEFERRALS, POST_HR_INTERVAL, POST_WB_INFO, PUBLISH_TIMEOUT, MISC_WB_INFO, cfg, executor, http_manager, ingest_pool, log, media_cache, notifier, post_queue, post_runner, prefetcher, publish_scheduler
 
 class Bot(commands.Bot):
 	def __init__(self):
 		super().__init__(intents = discord.Intents.default(), command_prefix='')
 
 	async def setup_hook(self):
+		await http_manager.start()
+		prefetcher.start()
+		ingest_pool.start()
 		await self.setupCommands("cogs")
 
 		try:
@@ -66,6 +66,21 @@ class Bot(commands.Bot):
 
 		post_loop.start()
 
+	async def close(self):
+		# stop any post in progress, then release everything it might've been using
+		post_loop.cancel()
+		await post_runner.cancel()
+		await ingest_pool.close()
+		await prefetcher.stop()
+		await media_cache.flush()
+		await notifier.close()
+		await http_manager.close()
+		executor.shutdown()
+
+		# write any pending config changes before shutting down
+		cfg.flush()
+		await super().close()
+
 
 @tasks.loop(hours = POST_HR_INTERVAL)
 async def post_loop():
@@ -74,34 +89,136 @@ async def post_loop():
 	goal_timestamp = current_time + timedelta(hours = 4, minutes = -current_time.minute, seconds = -current_time.second, microseconds = -current_time.microsecond)
 	cfg.set('next_post_time', int(goal_timestamp.timestamp()))
 
-	# start post function on separate thread
-	post_thread = threading.Thread(target = asyncio.run, args = (post))
-	post_thread.start()
-	post_thread.join()
+	# run the post in the background on the bot's own loop, so the bot stays responsive while it runs
+	post_runner.submit(post)
+
+def notify_post(**kwargs):
+	"""
+	Queues a message to the post notification webhook (if it's enabled)
+	"""
+
+	if cfg.settings.discord.post_notifs.enabled:
+		notifier.send(cfg.settings.discord.post_notifs.webhook, username = POST_WB_INFO['username'], avatar_url = POST_WB_INFO['pfp'], **kwargs)
+
+def notify_misc(**kwargs):
+	"""
+	Queues a message to the misc notification webhook (if it's enabled)
+	"""
+
+	if cfg.settings.discord.misc_notifs.enabled:
+		notifier.send(cfg.settings.discord.misc_notifs.webhook, username = MISC_WB_INFO['username'], avatar_url = MISC_WB_INFO['pfp'], **kwargs)
+
+async def publish(platform_name: str, publisher, post: dict, path: Path, delivery: Delivery):
+	"""
+	Posts to a single platform, making sure that an error or timeout doesn't affect the other platforms
+
+	The publisher is run through the scheduler, which retries it with backoff and keeps track of the
+	platform's rate limits. The attempt is recorded on the post's delivery, and if it doesn't fully go
+	through, the delivery is marked as failed so that the next post cycle retries it. If the platform
+	is deferred (i.e it's rate limited for a while, or its circuit breaker is open), the attempt counts
+	as a deferral instead, which are capped separately.
+
+	Args
+	----
+	- platform_name: str
+		- The name of the platform, used for logging
+	- publisher: Callable
+		- The function that posts to the platform
+	- post: dict
+		- The post to post
+	- path: Path
+		- The path of the gif within the media cache
+	- delivery: Delivery
+		- The post's delivery to the platform
+
+	Returns
+	----
+	- Union[str, bool, None]
+		- The URL of the post, or False/None if posting failed
+	"""
+
+	log.info(f'Posting to {platform_name} (attempt {delivery.attempts + 1})...')
+	await delivery.attempt()
+
+	try:
+		result = await asyncio.wait_for(publish_scheduler.run(delivery.platform, publisher, post, path, delivery), timeout = PUBLISH_TIMEOUT)
+	except DeferredError as error:
+		log.warning(f"Not posting to {platform_name} yet: {error}")
+		await delivery.deferred(str(error))
+		return None
+	except asyncio.TimeoutError:
+		log.error(f"Timed out after {PUBLISH_TIMEOUT} seconds while posting to {platform_name}")
+		await delivery.failed(f"Timed out after {PUBLISH_TIMEOUT} seconds")
+		return False
+	except:
+		log.error(f"An error occurred while posting to {platform_name}\n{traceback.format_exc()}")
+		await delivery.failed(traceback.format_exc(limit = 1))
+		return False
+
+	if not delivery.complete:
+		await delivery.failed("The post didn't fully go through")
+
+	return result
 
 async def post():
 	try:
 		print("")
 		log.info('Running post loop...')
 
-		client = AsyncClient()
-		session = aiohttp.ClientSession()
-		queue = cfg.get('queue')
+		# Posts that only partially went out during a previous cycle are retried alongside the next post,
+		# so a platform that keeps failing never holds up the rest of the queue
+		retries = post_queue.retries()
+		post = post_queue.head()
 
 		# Check to see if there are any posts in the queue
-		if len(queue) == 0:
-			await client.aclose()
-			await session.close()
+		if not post and not retries:
 			return log.info("No posts in queue. Skipping...")
 
 		# Check to see if every platform is disabled (we don't want to run)
-		if not cfg.get('twitter.enabled') and not cfg.get('tumblr.enabled') and not cfg.get('mastodon.enabled'):
-			await client.aclose()
-			await session.close()
+		if not cfg.settings.twitter.enabled and not cfg.settings.tumblr.enabled and not cfg.settings.mastodon.enabled:
 			return log.info("All platforms are disabled. Skipping...")
 
+		if len(retries) != 0:
+			log.info(f"Retrying {len(retries)} post(s) that didn't fully go out during a previous cycle...")
+
+		await asyncio.gather(
+			*[deliver_post(retry, retrying = True) for retry in retries],
+			*([deliver_post(post)] if post else []),
+		)
+
+		if (http_stats := http_manager.format_stats()):
+			log.info(f"HTTP stats:\n{http_stats}")
+	except:
+		log.error(f"An error occurred while running the post loop\n{traceback.format_exc()}")
+
+async def finish_post(post: dict, retrying: bool):
+	"""
+	Removes a post that's done with, either from the head of the queue or from the retry set
+	"""
+
+	if retrying:
+		await post_queue.finish_retry(post['id'])
+	else:
+		await post_queue.pop_head(post['id'])
+
+async def deliver_post(post: dict, retrying: bool = False):
+	"""
+	Posts a single post to every platform it hasn't gone out to yet
+
+	If any platform fails but still has attempts left, the post is parked in the retry set (if it
+	isn't already), and the next cycle retries just that platform alongside the next post. Once every
+	platform has either gone through or run out of attempts, the post is announced and removed.
+
+	Args
+	----
+	- post: dict
+		- The post to post
+	- retrying: bool
+		- Whether or not the post is being retried from the retry set, rather than being the head of the queue
+	"""
+
+	try:
 		# Initialize the post parameters to make it easier later on
-		post = queue[0]
 		caption = post.get('caption', '')
 		alt_text = post.get('alt_text', '')
 		author = post.get('author', '')
@@ -109,117 +226,137 @@ async def post():
 		catbox_url = post.get('catbox_url', '')
 		orig_url = post.get('original_url', '')
 
-		# Initialize job directory and assign random ID
-		if os.path.exists("jobs/"):
-			shutil.rmtree("jobs/")
 
-		os.mkdir("jobs")
-		job_id = "".join(random.choice(string.ascii_letters + string.digits) for i in range(32))
+		# Work out which platforms to post to
+		# Every enabled platform is posted to at the same time, each with its own timeout and error handling
+		# A retried post only goes to the platforms it's still missing from, and platforms that have failed
+		# too many times are given up on
+		publishers = {}
 
-		# Initialize the webhook clients in a try/catch block in the event that it errors
-		post_wb: discord.Webhook = ""
-		misc_wb: discord.Webhook = ""
+		if cfg.settings.twitter.enabled:
+			publishers["twitter"] = ("Twitter", post_twitter)
 
-		try:
-			if cfg.get('discord.post_notifs.enabled'):
-				post_wb = discord.Webhook.from_url(cfg.get('discord.post_notifs.webhook'), session = session)
+		if cfg.settings.mastodon.enabled:
+			publishers["mastodon"] = ("Mastodon", post_mastodon)
 
-			if cfg.get('discord.misc_notifs.enabled'):
-				misc_wb = discord.Webhook.from_url(cfg.get('discord.misc_notifs.webhook'), session = session)
-		except:
-			log.error(f"An error occurred while initializing the webhook client\n{traceback.format_exc()}")
-			await client.aclose()
-			await session.close()
-			return
+		if cfg.settings.tumblr.enabled:
+			publishers["tumblr"] = ("Tumblr", post_tumblr)
+
+		records = post_queue.deliveries(post['id'])
+		if retrying:
+			publishers = {key: publisher for key, publisher in publishers.items() if key in records}
+
+			# Every platform it was waiting on has since been disabled, so there's nothing left to retry
+			if len(publishers) == 0:
+				log.warning(f"Every platform {catbox_url} was waiting on has been disabled. Giving up on it...")
+				return await finish_post(post, retrying)
+
+		deliveries = {key: Delivery(post_queue, post['id'], key, records.get(key)) for key in publishers.keys()}
+		# Platforms whose circuit breaker is open (they've been failing over and over) are deferred by the scheduler
+		# without being attempted, so they stay pending and are retried once they've recovered
+		pending = [key for key, delivery in deliveries.items() if not delivery.complete and not delivery.exhausted(MAX_DELIVERY_ATTEMPTS, MAX_DELIVERY_DEFERRALS)]
 
 
-		# Download and write the gif to the system before posting, in order to ensure everything is legitimate
+		# Download the gif to the system before posting, in order to ensure everything is legitimate
+		# If it's already in the media cache (i.e it was prefetched, or this is a retry), it isn't downloaded again
+		# The gif is streamed straight to disk, and the download is aborted as soon as it goes over the size limit
 		# If an error occurs, i.e the web server times out, we want to catch it
-		res: Response = ""
+		res = ""
 
 		try:
-			res = await client.get(catbox_url, headers = BASE_HEADERS, timeout = 30)
+			res = await media_cache.fetch(catbox_url)
+		except FileTooLargeError:
+			res = None
 		except:
 			log.error(f"An error occurred while downloading the gif\n{traceback.format_exc()}")
-			embed = discord.Embed(title = "Error", description = "An error occurred while downloading the gif.", color = discord.Color.from_str(cfg.get('discord.embed_colors.error')))
+			embed = discord.Embed(title = "Error", description = "An error occurred while downloading the gif.", color = discord.Color.from_str(cfg.settings.discord.embed_colors.error))
 			embed.add_field(name = "Error", value = f"```{traceback.format_exc()}```", inline = False)
-			await client.aclose()
-			await session.close()
-			return await misc_wb.send(embed = embed, username = MISC_WB_INFO['username'], avatar_url = MISC_WB_INFO['pfp'])
+			notify_misc(embed = embed)
 
+			# A retried post counts this as an attempt on every platform it's waiting on, so it's never retried forever
+			if retrying:
+				for key in pending:
+					await deliveries[key].attempt()
+					await deliveries[key].failed("Unable to download the gif")
 
-		# If the server returns a non-ok status code, we want to respond accordingly as well
-		if res.status_code != 200:
+			return
+
+
+		# If the server returns a non-ok status code, or the gif is too large, we want to respond accordingly as well
+		if not res or res.status_code != 200:
 			err_hdr = 'An error occurred while downloading the gif'
-			err_dsc = f"The server returned a non-ok status code ({res.status_code})."
+			err_dsc = f"The server returned a non-ok status code ({res.status_code})." if res else f"The gif is larger than {GIF_SIZE_LIMIT} bytes."
 
 			log.error(f"{err_hdr}\n{err_dsc}")
-			embed = discord.Embed(title = "Error", description = err_hdr, color = discord.Color.from_str(cfg.get('discord.embed_colors.error')))
+			embed = discord.Embed(title = "Error", description = err_hdr, color = discord.Color.from_str(cfg.settings.discord.embed_colors.error))
 			embed.add_field(name = "Error", value = f"```{err_dsc}```", inline = False)
-			await misc_wb.send(embed = embed, username = MISC_WB_INFO['username'], avatar_url = MISC_WB_INFO['pfp'])
+			notify_misc(embed = embed)
 
-			# We also want to remove the tweet from the queue, so that the bot doesn't attempt to post it again
-			queue.pop(0)
-			cfg.set('queue', queue)
+			# We also want to remove the post, so that the bot doesn't attempt to post it again
+			await finish_post(post, retrying)
 
-			await client.aclose()
-			await session.close()
 			return
 
 
-		# Write the gif to the jobs directory
-		with open(f"jobs/{job_id}.gif", "wb") as f:
-			f.write(res.content)
+		log.info(f"Using {res.path} ({res.size} bytes)")
 
 
 		# Now, begin the actual posting.
-		# Assign the post data to individual variables in order to make accessing the properties easier
-		res_data = {}
-
-		# Twitter
-		if cfg.get('twitter.enabled'):
-			log.info('Posting to Twitter...')
-			try:
-				res_data["twitter"] = await post_twitter(post, job_id)
-			except:
-				log.error(f"An error occurred while posting to Twitter\n{traceback.format_exc()}")
-				res_data["twitter"] = False
-
-		# Mastodon
-		if cfg.get('mastodon.enabled'):
-			log.info('Posting to Mastodon...')
-			try:
-				res_data["mastodon"] = await post_mastodon(post, job_id)
-			except:
-				log.error(f"An error occurred while posting to Mastodon\n{traceback.format_exc()}")
-				res_data["mastodon"] = False
-
-		# Tumblr
-		if cfg.get('tumblr.enabled'):
-			log.info('Posting to Tumblr...')
-			try:
-				res_data["tumblr"] = await post_tumblr(post, job_id)
-			except:
-				log.error(f"An error occurred while posting to Tumblr\n{traceback.format_exc()}")
-				res_data["tumblr"] = False
-
-
-		# Check to see the results of each function call, if any of them are false or None we don't want to count them
-		# If the platforms array is empty, we want to return an error
-		platforms = [key.title() for key in res_data.keys() if res_data[key] != False and res_data[key] != None]
-		if len(platforms) == 0:
-			log.error(f"An error occurred while posting the gif\nAll platforms failed to post.")
+		# The gif is held in the cache while posting, so that it isn't able to be evicted mid-upload
+		with media_cache.hold(res.sha256) as path:
+			await asyncio.gather(*[
+				publish(publishers[key][0], publishers[key][1], post, path, deliveries[key])
+				for key in pending
+			])
+
+
+		# If any platform failed but still has attempts left, the post is parked in the retry set,
+		# and the next cycle only retries the platforms it's missing from (alongside the next post)
+		retrying_platforms = [publishers[key][0] for key, delivery in deliveries.items() if not delivery.complete and not delivery.exhausted(MAX_DELIVERY_ATTEMPTS, MAX_DELIVERY_DEFERRALS)]
+		if len(retrying_platforms) != 0:
+			log.error(f"An error occurred while posting the gif\nFailed to post to {', '.join(retrying_platforms)}. Retrying next cycle.")
 
-			if cfg.get('discord.misc_notifs.enabled'):
-				embed = discord.Embed(title = "Error", description = "An error occurred while posting the gif.\nAll platforms failed to post.", color = discord.Color.from_str(cfg.get('discord.embed_colors.error')))
-				await misc_wb.send(embed = embed, username = MISC_WB_INFO['username'], avatar_url = MISC_WB_INFO['pfp'])
+			if not retrying:
+				await post_queue.park_head(post['id'])
 
-			await client.aclose()
-			await session.close()
+			if cfg.settings.discord.misc_notifs.enabled:
+				embed = discord.Embed(title = "Error", description = f"An error occurred while posting the gif.\nFailed to post to {', '.join(retrying_platforms)}, which will be retried next cycle.", color = discord.Color.from_str(cfg.settings.discord.embed_colors.error))
+				embed.set_image(url = orig_url)
+				notify_misc(embed = embed)
 
 			return
 
-		embed = discord.Embed(title = "New post", color = discord.Color.from_str(cfg.get('discord.embed_colors.success')))
+
+		# Report any platform that ran out of attempts, as it won't be part of the announcement
+		given_up = {key: delivery for key, delivery in deliveries.items() if not delivery.complete}
+		if len(given_up) != 0:
+			names = ', '.join(publishers[key][0] for key in given_up.keys())
+			log.error(f"Gave up on posting the gif to {names} after {MAX_DELIVERY_ATTEMPTS} failed attempts or {MAX_DELIVERY_DEFERRALS} deferred ones.")
+
+			if cfg.settings.discord.misc_notifs.enabled:
+				embed = discord.Embed(title = "Error", description = f"Gave up on posting the gif to {names} after {MAX_DELIVERY_ATTEMPTS} failed attempts or {MAX_DELIVERY_DEFERRALS} deferred ones.", color = discord.Color.from_str(cfg.settings.discord.embed_colors.error))
+				embed.set_image(url = orig_url)
+
+				for key, delivery in given_up.items():
+					embed.add_field(name = publishers[key][0], value = f"```{(delivery.error or 'Unknown error')[:1000]}```", inline = False)
+
+				notify_misc(embed = embed)
+
+
+		# Check to see which platforms the post went out to, if any of them don't have a URL we don't want to count them
+		# If the platforms array is empty, every platform ran out of attempts, so we want to give up on the post
+		platforms = [publishers[key][0] for key, delivery in deliveries.items() if delivery.url]
+		if len(platforms) == 0:
+			log.error("An error occurred while posting the gif\nAll platforms ran out of attempts.")
+
+			if cfg.settings.discord.misc_notifs.enabled:
+				embed = discord.Embed(title = "Error", description = "An error occurred while posting the gif.\nAll platforms ran out of attempts, so it has been removed from the queue.", color = discord.Color.from_str(cfg.settings.discord.embed_colors.error))
+				notify_misc(embed = embed)
+
+			await finish_post(post, retrying)
+			return
+
+		embed = discord.Embed(title = "New post", color = discord.Color.from_str(cfg.settings.discord.embed_colors.success))
 		embed.set_image(url = orig_url)
 
 		if caption != '':
@@ -229,43 +366,27 @@ async def post():
 		embed.add_field(name = "Gif URL", value = catbox_url, inline = False)
 		embed.add_field(name = "Posted by", value = f'<@!{author}> - {emoji}', inline = False)
 
-		linksStr = '\n'.join([f'- [{platform_name}]({res_data[platform_name.lower()]})' for platform_name in platforms])
+		linksStr = '\n'.join([f'- [{publishers[key][0]}]({delivery.url})' for key, delivery in deliveries.items() if delivery.url])
 		embed.add_field(name = "Post links", value = linksStr, inline = False)
 
 
-		# Send the embed to the post notification webhook
-		if cfg.get('discord.post_notifs.enabled'):
-			role_to_ping = cfg.get('discord.post_notifs.role_to_ping')
-			await post_wb.send(content = f"<@&{role_to_ping}>", embed = embed, username = POST_WB_INFO['username'], avatar_url = POST_WB_INFO['pfp'])
-
-		await asyncio.sleep(3)
-
-
-		# Send the embed to the misc notification webhook to alert the author that the post was successful
-		if cfg.get('discord.misc_notifs.enabled'):
-			await misc_wb.send(content = f"<@!{author}>", embed = embed, username = MISC_WB_INFO['username'], avatar_url = MISC_WB_INFO['pfp'])
+		# Send the embed to the post notification webhook, and to the misc notification webhook to alert the author that the post was successful
+		# Both are sent in the background, so a slow or broken webhook never holds up the queue
+		notify_post(content = f"<@&{cfg.settings.discord.post_notifs.role_to_ping}>", embed = embed)
+		notify_misc(content = f"<@!{author}>", embed = embed)
 
 
 		# Remove post from queue now that its been posted
-		if len(queue) > 0:
-			queue.pop(0)
-
-		cfg.set('queue', queue)
-
-		# Close the sessions since we're done with them
-		await client.aclose()
-		await session.close()
+		await finish_post(post, retrying)
 	except:
-		log.error(f"An error occurred while running the post loop\n{traceback.format_exc()}")
-		if client: await client.aclose()
-		if session: await session.close()
+		log.error(f"An error occurred while posting {post.get('catbox_url', '')}\n{traceback.format_exc()}")
 
 
 
 
 
 
-token = cfg.get('discord.token')
+token = cfg.settings.discord.token
 if token == '':
 	log.error('No token provided in config.json. Exiting...')
 	exit()
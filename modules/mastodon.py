@@ -1,23 +1,158 @@
+import asyncio
 import traceback
-from mastodon import Mastodon
-from tenacity import retry, stop_after_attempt, retry_if_result
-from utils.globals import log, cfg, CAT_TAGS
+import httpx
+from pathlib import Path
+from utils.backoff import poll
+from utils.globals import MEDIA_PROCESSING_TIMEOUT, log, cfg, http_manager, publish_scheduler
 
-@retry(stop=stop_after_attempt(3), retry = retry_if_result(lambda result: result is False))
-async def post_mastodon(post, job_id):
-	# Mastodon API client
-	mstdn: Mastodon = ""
+# How long media processing has taken on each instance, used to tune the backoff
+media_processing_stats: dict = {}
 
-	try:
-		mstdn = Mastodon(
-			client_id = cfg.get('mastodon.client_id'),
-			client_secret = cfg.get('mastodon.client_secret'),
-			access_token = cfg.get('mastodon.access_token'),
-			api_base_url = cfg.get('mastodon.api_url')
+def mastodon_url(settings, endpoint: str) -> str:
+	"""
+	Returns the full URL of an API endpoint on the configured instance
+
+	Args
+	----
+	- settings: MastodonSettings
+		- The Mastodon settings
+	- endpoint: str
+		- The endpoint, i.e `/api/v2/media`
+	"""
+
+	return f"{settings.api_url.rstrip('/')}{endpoint}"
+
+async def upload_media(client: httpx.AsyncClient, settings, headers: dict, path: Path, alt_text: str) -> dict:
+	"""
+	Uploads a gif to Mastodon, streaming it straight from the media cache
+
+	Args
+	----
+	- client: httpx.AsyncClient
+		- The shared HTTP client
+	- settings: MastodonSettings
+		- The Mastodon settings
+	- headers: dict
+		- The authorization headers
+	- path: Path
+		- The path of the gif
+	- alt_text: str
+		- The alt text of the gif
+
+	Returns
+	----
+	- dict
+		- The uploaded media, whose `url` is None if it's still being processed
+	"""
+
+	with open(path, 'rb') as f:
+		res = await client.post(
+			mastodon_url(settings, '/api/v2/media'),
+			headers = headers,
+			files = {'file': (path.name, f, 'image/gif')},
+			data = {'description': alt_text},
+			timeout = 120
 		)
-	except:
-		log.error(f"An error occurred while initializing the Mastodon API client\n{traceback.format_exc()}")
-		return
+
+	publish_scheduler.check_response('mastodon', res.status_code, res.headers)
+	res.raise_for_status()
+	return res.json()
+
+async def wait_for_media(client: httpx.AsyncClient, settings, headers: dict, media: dict) -> dict:
+	"""
+	Waits for Mastodon to finish processing an uploaded gif
+
+	Large media is processed asynchronously, in which case the upload returns 202 and the media's
+	`url` stays None (with the media endpoint returning 206) until processing is done. The media is
+	checked again with a growing, jittered delay between each check, up until MEDIA_PROCESSING_TIMEOUT.
+
+	Args
+	----
+	- client: httpx.AsyncClient
+		- The shared HTTP client
+	- settings: MastodonSettings
+		- The Mastodon settings
+	- headers: dict
+		- The authorization headers
+	- media: dict
+		- The media returned from uploading the gif
+
+	Returns
+	----
+	- dict
+		- The processed media
+
+	Raises
+	----
+	- asyncio.TimeoutError
+		- If the media still hasn't been processed once the deadline has passed
+	"""
+
+	# Small media is processed straight away, so there's nothing to wait for
+	if media.get('url', None) is not None:
+		return media
+
+	async def check():
+		res = await client.get(mastodon_url(settings, f"/api/v1/media/{media['id']}"), headers = headers)
+		publish_scheduler.check_response('mastodon', res.status_code, res.headers)
+		if res.status_code == 206:
+			return None
+
+		res.raise_for_status()
+		data = res.json()
+		return data if data.get('url', None) is not None else None
+
+	result = await poll(check, deadline = MEDIA_PROCESSING_TIMEOUT, initial = 1.0, factor = 1.5, maximum = 15.0)
+
+	stats = media_processing_stats.setdefault(settings.api_url, {'count': 0, 'total': 0.0, 'max': 0.0})
+	stats['count'] += 1
+	stats['total'] += result.elapsed
+	stats['max'] = max(stats['max'], result.elapsed)
+	log.info(f"Mastodon finished processing the gif in {result.elapsed:.1f}s ({result.attempts} checks, {stats['total'] / stats['count']:.1f}s avg on {settings.api_url})")
+
+	return result.value
+
+async def create_status(client: httpx.AsyncClient, settings, headers: dict, status: dict, idempotency_key: str) -> dict:
+	"""
+	Posts a status to Mastodon
+
+	Each status is sent with an idempotency key, so that if the post is retried after the status
+	was actually posted, Mastodon returns the existing status rather than posting it twice.
+
+	Args
+	----
+	- client: httpx.AsyncClient
+		- The shared HTTP client
+	- settings: MastodonSettings
+		- The Mastodon settings
+	- headers: dict
+		- The authorization headers
+	- status: dict
+		- The status parameters, i.e `{'status': 'meow', 'media_ids': ['1']}`
+	- idempotency_key: str
+		- A key unique to this status
+
+	Returns
+	----
+	- dict
+		- The posted status
+	"""
+
+	res = await client.post(
+		mastodon_url(settings, '/api/v1/statuses'),
+		headers = {**headers, 'Idempotency-Key': idempotency_key},
+		json = status
+	)
+
+	publish_scheduler.check_response('mastodon', res.status_code, res.headers)
+	res.raise_for_status()
+	return res.json()
+
+async def post_mastodon(post, path, delivery):
+	# Mastodon is talked to directly over the shared HTTP client, so its connections are reused across posts
+	client = http_manager.client
+	settings = cfg.settings.mastodon
+	headers = {'Authorization': f'Bearer {settings.access_token}'}
 
 	# Assign the post data to individual variables in order to make accessing the properties easier
 	caption = post.get('caption', '')
@@ -26,28 +161,51 @@ async def post_mastodon(post, job_id):
 	catbox_url = post.get('catbox_url', '')
 
 
-	# Post to mastodon
-	media = mstdn.media_post(f"jobs/{job_id}.gif", mime_type = "image/gif", description=alt_text)
+	# Anything a previous attempt already got done (the upload, or the status itself) isn't done again
+	if not delivery.status_id:
+		if not delivery.media_id:
+			# Upload the gif to mastodon
+			try:
+				media = await upload_media(client, settings, headers, path, alt_text)
+				media = await wait_for_media(client, settings, headers, media)
+			except asyncio.TimeoutError:
+				log.error(f"Mastodon didn't finish processing the gif within {MEDIA_PROCESSING_TIMEOUT} seconds")
+				return False
+			except httpx.HTTPError:
+				log.error(f"An error occurred while uploading the gif to Mastodon\n{traceback.format_exc()}")
+				return False
 
-	hasFinishedProcessing = False
-	while not hasFinishedProcessing:
-		res = mstdn.media(media['id'])
-		if res.get('url', None) is not None:
-			hasFinishedProcessing = True
+			await delivery.uploaded(media['id'])
 
-	post = mstdn.status_post(
-		status = caption,
-		media_ids = [media]
-	)
 
-	mstdn.status_post(
-		status = f"{catbox_url} - {emoji}",
-		in_reply_to_id = post["id"]
-	)
+		# Post to mastodon
+		try:
+			status = await create_status(client, settings, headers, {
+				'status': caption,
+				'media_ids': [delivery.media_id]
+			}, idempotency_key = f"post-{post['id']}")
+		except httpx.HTTPError:
+			log.error(f"An error occurred while posting to Mastodon\n{traceback.format_exc()}")
+			return False
+
+		if status.get('url', None) is None:
+			log.error(f"An error occurred while posting to Mastodon\n{status}")
+			return False
 
-	if post.get('url', None) is None:
-		log.error(f"An error occurred while posting to Mastodon\n{post}")
+		await delivery.posted(status['id'], status['url'])
+
+
+	# Reply to the post with the gif URL
+	try:
+		await create_status(client, settings, headers, {
+			'status': f"{catbox_url} - {emoji}",
+			'in_reply_to_id': delivery.status_id
+		}, idempotency_key = f"reply-{post['id']}")
+	except httpx.HTTPError:
+		log.error(f"An error occurred while replying to the Mastodon post\n{traceback.format_exc()}")
 		return False
 
-	log.success(f'Successfully posted to Mastodon! {post["url"]}')
-	return post['url']
\ No newline at end of file
+	await delivery.replied()
+
+	log.success(f'Successfully posted to Mastodon! {delivery.url}')
+	return delivery.url
@@ -1,51 +1,127 @@
-import pytumblr
+import json
 import traceback
-from tenacity import retry, stop_after_attempt, retry_if_result
-from utils.globals import log, cfg, CAT_HASHTAGS
+import httpx
+from pathlib import Path
+from utils.globals import log, cfg, clients, http_manager, publish_scheduler, CAT_HASHTAGS
+from utils.oauth import OAuth1Signer
 
-@retry(stop=stop_after_attempt(3), retry = retry_if_result(lambda result: result is False))
-async def post_tumblr(post, job_id):
-	# Tumblr API client
-	tmblr: pytumblr.TumblrRestClient = ""
+TUMBLR_API_URL = "https://api.tumblr.com/v2"
+
+def create_tumblr_signer(settings):
+	"""
+	Creates the OAuth signer used to authorize Tumblr requests
+
+	Args
+	----
+	- settings: TumblrSettings
+		- The Tumblr settings to create the signer with
+	"""
+
+	return OAuth1Signer(
+		settings.consumer_key,
+		settings.consumer_secret,
+		settings.oauth_token,
+		settings.oauth_secret
+	)
+
+clients.register('tumblr', create_tumblr_signer)
+
+def bold_text(label: str, value: str, url: str = '') -> dict:
+	"""
+	Creates an NPF text block with a bold label, i.e `Alt text: a cat`
+
+	Args
+	----
+	- label: str
+		- The label, which is made bold
+	- value: str
+		- The text following the label
+	- url: Optional[str]
+		- If given, the value is made into a link to this URL
+	"""
+
+	text = f'{label}: {value}'
+	formatting = [{'start': 0, 'end': len(label) + 1, 'type': 'bold'}]
+
+	if url:
+		formatting.append({'start': len(label) + 2, 'end': len(text), 'type': 'link', 'url': url})
+
+	return {'type': 'text', 'text': text, 'formatting': formatting}
+
+async def post_tumblr(post, path, delivery):
+	# OAuth signer (created once, then reused until the credentials change)
+	signer: OAuth1Signer = ""
+
+	settings = cfg.settings.tumblr
 
 	try:
-		tmblr = pytumblr.TumblrRestClient(
-			cfg.get('tumblr.consumer_key'),
-			cfg.get('tumblr.consumer_secret'),
-			cfg.get('tumblr.oauth_token'),
-			cfg.get('tumblr.oauth_secret')
-		)
+		signer = await clients.get('tumblr', settings)
 	except:
-		log.error(f"An error occurred while initializing the Tumblr API client\n{traceback.format_exc()}")
+		log.error(f"An error occurred while initializing the Tumblr OAuth signer\n{traceback.format_exc()}")
 		return
 
+	# A previous attempt already posted it, so there's nothing left to do
+	if delivery.status_id:
+		await delivery.replied()
+		return delivery.url
+
 	# Assign the post data to individual variables in order to make accessing the properties easier
 	caption = post.get('caption', '')
 	alt_text = post.get('alt_text', '')
 	emoji = post.get('emoji', '')
 	catbox_url = post.get('catbox_url', '')
 
-	newCaption = ''
+
+	# Build the post in the Neue Post Format
+	# The gif is either uploaded alongside the post, or referenced straight from catbox
+	media = {'type': 'image/gif', 'url': catbox_url} if settings.use_catbox_url else {'type': 'image/gif', 'identifier': 'gif'}
+	content = [{'type': 'image', 'media': [media], 'alt_text': alt_text}]
+
 	if caption != '':
-		newCaption = f"{caption} <br><br>"
+		content.append({'type': 'text', 'text': caption})
+
+	content += [
+		bold_text('Alt text', alt_text),
+		bold_text('Gif URL', catbox_url, url = catbox_url),
+		bold_text('Posted by', emoji),
+	]
 
-	newCaption += f'<strong>Alt text:</strong> {alt_text} <br><br><strong>Gif URL:</strong> {catbox_url} <br><br><strong>Posted by:</strong> {emoji}'
+	body = {
+		'content': content,
+		'tags': ','.join([f'posted-by-{emoji}'] + CAT_HASHTAGS),
+		'state': 'published',
+	}
 
 
 	# Post to tumblr
-	blog_name = cfg.get('tumblr.blog_name')
-	res = tmblr.create_photo(
-		caption = newCaption,
-		tags = [f'posted-by-{emoji}'] + CAT_HASHTAGS,
-		data = f"jobs/{job_id}.gif",
-		state = 'published',
-		blogname = blog_name,
-		slug = job_id
-	)
+	blog_name = settings.blog_name
+	url = f'{TUMBLR_API_URL}/blog/{blog_name}/posts'
+	headers = {'Authorization': signer.authorization('POST', url)}
+	client = http_manager.client
 
-	if res.get('id', None) is None:
-		log.error(f"An error occurred while posting to Tumblr\n{res}")
+	try:
+		if settings.use_catbox_url:
+			res = await client.post(url, headers = headers, json = body)
+		else:
+			with open(Path(path), 'rb') as f:
+				res = await client.post(url, headers = headers, timeout = 120, files = [
+					('json', (None, json.dumps(body), 'application/json')),
+					('gif', (Path(path).name, f, 'image/gif')),
+				])
+	except httpx.HTTPError:
+		log.error(f"An error occurred while posting to Tumblr\n{traceback.format_exc()}")
 		return False
 
-	log.success(f'Successfully posted to Tumblr! https://{blog_name}.tumblr.com/post/{res["id"]}')
-	return f'https://{blog_name}.tumblr.com/post/{res["id"]}'
\ No newline at end of file
+	publish_scheduler.check_response('tumblr', res.status_code, res.headers)
+
+	post_id = res.json().get('response', {}).get('id', None) if res.is_success else None
+	if post_id is None:
+		log.error(f"An error occurred while posting to Tumblr\n{res.status_code} {res.text}")
+		return False
+
+	# Tumblr posts don't get a reply, so the delivery is complete as soon as the post is up
+	await delivery.posted(post_id, f'https://{blog_name}.tumblr.com/post/{post_id}')
+	await delivery.replied()
+
+	log.success(f'Successfully posted to Tumblr! {delivery.url}')
+	return delivery.url
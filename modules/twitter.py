@@ -1,28 +1,315 @@
+import asyncio
+import math
+import time
+import requests
 import tweepy
 import traceback
-from tenacity import retry, stop_after_attempt, retry_if_result
-from utils.globals import log, cfg, CAT_HASHTAGS
+import httpx
+from dataclasses import dataclass, field
+from pathlib import Path
+from urllib.parse import urlencode
+from utils.backoff import backoff_delay, poll
+from utils.globals import MEDIA_PROCESSING_TIMEOUT, log, cfg, clients, executor, http_manager, publish_scheduler
+from utils.oauth import OAuth1Signer
+
+TWITTER_UPLOAD_URL = "https://upload.twitter.com/1.1/media/upload.json"
+SEGMENT_SIZE = 1024 * 1024 # Size of each APPEND segment, in bytes
+UPLOAD_CONCURRENCY = 4 # Maximum amount of segments uploaded at once
+SEGMENT_ATTEMPTS = 5 # Maximum amount of times a single segment is attempted before the upload is given up on
+
+# Uploads that haven't been tweeted yet, keyed by the path of the gif, so a retry is able to pick up where the last attempt left off
+pending_uploads: dict = {}
+
+class MediaProcessingError(Exception):
+	"""
+	Raised when Twitter fails to process an uploaded gif
+	"""
+
+@dataclass(slots = True)
+class MediaUpload:
+	media_id: str
+	total_bytes: int
+	expires_at: float
+	acknowledged: set = field(default_factory = set)
+	finalized: bool = False
+
+def create_twitter_clients(settings):
+	"""
+	Creates the Twitter v1.1 and v2 API clients
+
+	Args
+	----
+	- settings: TwitterSettings
+		- The Twitter settings to create the clients with
+	"""
+
+	tw_auth = tweepy.OAuth1UserHandler(
+		settings.consumer_key,
+		settings.consumer_secret,
+		settings.access_token,
+		settings.access_token_secret,
+	)
+
+	tw_v1 = tweepy.API(tw_auth)
+	tw_v2 = tweepy.Client(
+		consumer_key = settings.consumer_key,
+		consumer_secret = settings.consumer_secret,
+		access_token = settings.access_token,
+		access_token_secret = settings.access_token_secret,
+		bearer_token = settings.bearer_token,
+		# the raw response is returned, so its rate limit headers are able to be reported to the scheduler
+		return_type = requests.Response,
+	)
+
+	return tw_v1, tw_v2
+
+clients.register('twitter', create_twitter_clients)
+
+def create_twitter_signer(settings):
+	"""
+	Creates the OAuth signer used to authorize media uploads
+
+	Args
+	----
+	- settings: TwitterSettings
+		- The Twitter settings to create the signer with
+	"""
+
+	return OAuth1Signer(
+		settings.consumer_key,
+		settings.consumer_secret,
+		settings.access_token,
+		settings.access_token_secret,
+	)
+
+clients.register('twitter-upload', create_twitter_signer)
+
+def is_transient(error: Exception) -> bool:
+	"""
+	Whether or not a failed request is worth retrying (i.e a dropped connection or server error)
+
+	Rate limits aren't retried here, they're raised to the scheduler instead.
+	"""
+
+	if isinstance(error, httpx.HTTPStatusError):
+		return error.response.status_code >= 500
+
+	return isinstance(error, httpx.TransportError)
+
+async def upload_command(signer: OAuth1Signer, method: str, params: dict, files: dict = None) -> httpx.Response:
+	"""
+	Sends a single command to the media upload endpoint
+
+	Args
+	----
+	- signer: OAuth1Signer
+		- The signer to authorize the request with
+	- method: str
+		- The HTTP method, `GET` for STATUS and `POST` for everything else
+	- params: dict
+		- The command parameters, i.e `{'command': 'FINALIZE', 'media_id': '1'}`
+	- files: Optional[dict]
+		- The multipart files to send (only for APPEND, whose parameters aren't signed)
+
+	Returns
+	----
+	- httpx.Response
+		- The response, which is guaranteed to be successful
+	"""
+
+	client = http_manager.client
+
+	if method == 'GET':
+		url = f'{TWITTER_UPLOAD_URL}?{urlencode(params)}'
+		res = await client.get(url, headers = {'Authorization': signer.authorization('GET', url)})
+	elif files:
+		res = await client.post(TWITTER_UPLOAD_URL, headers = {'Authorization': signer.authorization('POST', TWITTER_UPLOAD_URL)}, data = params, files = files, timeout = 120)
+	else:
+		res = await client.post(TWITTER_UPLOAD_URL, headers = {'Authorization': signer.authorization('POST', TWITTER_UPLOAD_URL, params)}, data = params)
+
+	publish_scheduler.check_response('twitter', res.status_code, res.headers)
+	res.raise_for_status()
+	return res
+
+async def call_api(func, **kwargs):
+	"""
+	Calls a (blocking) tweepy function on the twitter thread pool, reporting rate limits to the scheduler
+
+	Rate limits are never waited out within the call, so that the scheduler is able to decide
+	whether to wait or to try again later. The v2 client returns the raw response, so the remaining
+	budget of every successful call is reported too, and the scheduler is able to back off before the
+	limit is hit.
+
+	Args
+	----
+	- func: Callable
+		- The tweepy function to call
+	- **kwargs
+		- The arguments to call the function with
+	"""
 
-@retry(stop=stop_after_attempt(3), retry = retry_if_result(lambda result: result is False))
-async def post_twitter(post, job_id):
-	# Twitter API clients
 	try:
-		tw_auth = tweepy.OAuth1UserHandler(
-			cfg.get('twitter.consumer_key'),
-			cfg.get('twitter.consumer_secret'),
-			cfg.get('twitter.access_token'),
-			cfg.get('twitter.access_token_secret'),
-		)
+		res = await executor.run('twitter', func, **kwargs)
+	except tweepy.TooManyRequests as error:
+		publish_scheduler.check_response('twitter', 429, error.response.headers)
+		raise
+
+	if isinstance(res, requests.Response):
+		publish_scheduler.check_response('twitter', res.status_code, res.headers)
+
+	return res
+
+async def append_segment(signer: OAuth1Signer, upload: MediaUpload, path: Path, index: int) -> None:
+	"""
+	Uploads a single segment of a gif, retrying it with backoff if it fails for a transient reason
+
+	Args
+	----
+	- signer: OAuth1Signer
+		- The signer to authorize the requests with
+	- upload: MediaUpload
+		- The upload the segment belongs to
+	- path: Path
+		- The path of the gif
+	- index: int
+		- The index of the segment
+	"""
 
-		tw_v1 = tweepy.API(tw_auth, wait_on_rate_limit = True)
-		tw_v2 = tweepy.Client(
-			consumer_key = cfg.get('twitter.consumer_key'),
-			consumer_secret = cfg.get('twitter.consumer_secret'),
-			access_token = cfg.get('twitter.access_token'),
-			access_token_secret = cfg.get('twitter.access_token_secret'),
-			bearer_token = cfg.get('twitter.bearer_token'),
-			wait_on_rate_limit = True,
+	with open(path, 'rb') as f:
+		f.seek(index * SEGMENT_SIZE)
+		chunk = f.read(SEGMENT_SIZE)
+
+	for attempt in range(SEGMENT_ATTEMPTS):
+		started_at = time.perf_counter()
+
+		try:
+			await upload_command(signer, 'POST', {
+				'command': 'APPEND',
+				'media_id': upload.media_id,
+				'segment_index': str(index),
+			}, files = {'media': ('blob', chunk, 'application/octet-stream')})
+		except httpx.HTTPError as error:
+			if not is_transient(error) or attempt == SEGMENT_ATTEMPTS - 1:
+				raise
+
+			delay = backoff_delay(attempt)
+			log.warning(f"Segment {index} of the Twitter upload failed ({error}), retrying in {delay:.1f}s...")
+			await asyncio.sleep(delay)
+			continue
+
+		elapsed = time.perf_counter() - started_at
+		upload.acknowledged.add(index)
+		log.info(f"Uploaded segment {index} to Twitter ({len(chunk)} bytes in {elapsed:.2f}s, {len(chunk) / elapsed / 1024:.0f} KB/s)")
+		return
+
+async def wait_for_processing(signer: OAuth1Signer, upload: MediaUpload, processing_info: dict) -> None:
+	"""
+	Waits for Twitter to finish processing an uploaded gif, checking its STATUS with backoff
+
+	Args
+	----
+	- signer: OAuth1Signer
+		- The signer to authorize the requests with
+	- upload: MediaUpload
+		- The finalized upload
+	- processing_info: dict
+		- The processing info returned from FINALIZE
+	"""
+
+	async def check():
+		res = await upload_command(signer, 'GET', {'command': 'STATUS', 'media_id': upload.media_id})
+		info = res.json().get('processing_info', {})
+
+		if info.get('state') == 'failed':
+			raise MediaProcessingError(info.get('error', {}).get('message', 'Unknown error'))
+
+		return info if info.get('state', 'succeeded') == 'succeeded' else None
+
+	# Twitter tells us how long to wait before the first check
+	result = await poll(check, deadline = MEDIA_PROCESSING_TIMEOUT, initial = max(1.0, processing_info.get('check_after_secs', 1)), factor = 1.5, maximum = 15.0)
+	log.info(f"Twitter finished processing the gif in {result.elapsed:.1f}s ({result.attempts} checks)")
+
+async def upload_media(signer: OAuth1Signer, path: Path) -> str:
+	"""
+	Uploads a gif to Twitter with the chunked upload API
+
+	Segments are uploaded concurrently (up to UPLOAD_CONCURRENCY at once). Every segment Twitter
+	acknowledges is remembered, so if the upload fails part way through, retrying it only sends the
+	segments that are missing, under the same media ID (as long as it hasn't expired).
+
+	Args
+	----
+	- signer: OAuth1Signer
+		- The signer to authorize the requests with
+	- path: Path
+		- The path of the gif
+
+	Returns
+	----
+	- str
+		- The media ID of the uploaded gif
+	"""
+
+	path = Path(path)
+	key = str(path)
+	total_bytes = path.stat().st_size
+
+	for stale_key in [k for k, upload in pending_uploads.items() if upload.expires_at <= time.time()]:
+		del pending_uploads[stale_key]
+
+	upload = pending_uploads.get(key)
+	if upload and upload.total_bytes == total_bytes:
+		log.info(f"Resuming the Twitter upload of {path.name} ({len(upload.acknowledged)} segments already uploaded)")
+	else:
+		res = await upload_command(signer, 'POST', {
+			'command': 'INIT',
+			'total_bytes': str(total_bytes),
+			'media_type': 'image/gif',
+			'media_category': 'tweet_gif',
+		})
+
+		data = res.json()
+		upload = MediaUpload(
+			media_id = data['media_id_string'],
+			total_bytes = total_bytes,
+			expires_at = time.time() + data.get('expires_after_secs', 86400),
 		)
+		pending_uploads[key] = upload
+
+	if upload.finalized:
+		return upload.media_id
+
+	semaphore = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+	missing = [i for i in range(math.ceil(total_bytes / SEGMENT_SIZE)) if i not in upload.acknowledged]
+
+	async def append(index: int):
+		async with semaphore:
+			await append_segment(signer, upload, path, index)
+
+	started_at = time.perf_counter()
+	await asyncio.gather(*[append(index) for index in missing])
+	elapsed = time.perf_counter() - started_at
+	log.info(f"Uploaded {len(missing)} segments to Twitter in {elapsed:.2f}s ({total_bytes / max(elapsed, 0.001) / 1024:.0f} KB/s)")
+
+	res = await upload_command(signer, 'POST', {'command': 'FINALIZE', 'media_id': upload.media_id})
+	processing_info = res.json().get('processing_info')
+
+	try:
+		if processing_info:
+			await wait_for_processing(signer, upload, processing_info)
+	except MediaProcessingError:
+		# The media is unusable, so the next attempt has to start over
+		pending_uploads.pop(key, None)
+		raise
+
+	upload.finalized = True
+	return upload.media_id
+
+async def post_twitter(post, path, delivery):
+	# Twitter API clients (created once, then reused until the credentials change)
+	try:
+		tw_v1, tw_v2 = await clients.get('twitter', cfg.settings.twitter)
+		signer = await clients.get('twitter-upload', cfg.settings.twitter)
 	except:
 		log.error(f"An error occurred while initializing the Twitter API clients\n{traceback.format_exc()}")
 		return
@@ -35,32 +322,51 @@ async def post_twitter(post, job_id):
 	catbox_url = post.get('catbox_url', '')
 
 
-	# Upload gif to twitter
-	mediaID = tw_v1.chunked_upload(
-		filename = f"jobs/{job_id}.gif",
-		media_category = "tweet_gif"
-	).media_id_string
+	# Anything a previous attempt already got done (the upload, or the tweet itself) isn't done again
+	if not delivery.status_id:
+		mediaID = delivery.media_id
+
+		if not mediaID:
+			# Upload gif to twitter
+			# If a previous attempt failed part way through the upload, this picks up where it left off
+			try:
+				mediaID = await upload_media(signer, path)
+			except (httpx.HTTPError, MediaProcessingError, asyncio.TimeoutError):
+				log.error(f"An error occurred while uploading the gif to Twitter\n{traceback.format_exc()}")
+				return False
+
+			# The SDK is blocking, so every other call goes through the twitter thread pool
+			if alt_text != "":
+				await call_api(
+					tw_v1.create_media_metadata,
+					media_id = mediaID,
+					alt_text = alt_text
+				)
 
-	if alt_text != "":
-		tw_v1.create_media_metadata(
-			media_id = mediaID,
-			alt_text = alt_text
+			await delivery.uploaded(mediaID)
+			pending_uploads.pop(str(path), None)
+
+		# Post tweet
+		tweet = await call_api(
+			tw_v2.create_tweet,
+			text = caption,
+			media_ids = [mediaID]
 		)
 
-	# Post tweet and reply to it with url & emoji
-	tweet = tw_v2.create_tweet(
-		text = caption,
-		media_ids = [mediaID]
-	)
+		tweet = tweet.json().get('data', {})
+		if tweet.get('id', None) is None:
+			log.error(f"An error occurred while posting to Twitter\n{tweet}")
+			return False
 
-	tw_v2.create_tweet(
+		await delivery.posted(tweet['id'], f"https://twitter.com/i/status/{tweet['id']}")
+
+	# Reply to the tweet with url & emoji
+	await call_api(
+		tw_v2.create_tweet,
 		text = f"{catbox_url} - {emoji}",
-		in_reply_to_tweet_id = tweet[0]["id"]
+		in_reply_to_tweet_id = delivery.status_id
 	)
+	await delivery.replied()
 
-	if tweet[0].get('id', None) is None:
-		log.error(f"An error occurred while posting to Twitter\n{tweet}")
-		return False
-
-	log.success(f'Successfully posted to Twitter! https://twitter.com/i/status/{tweet[0]["id"]}')
-	return f"https://twitter.com/i/status/{tweet[0]['id']}"
\ No newline at end of file
+	log.success(f'Successfully posted to Twitter! {delivery.url}')
+	return delivery.url
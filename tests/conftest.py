@@ -0,0 +1,25 @@
+import importlib
+import sys
+from pathlib import Path
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture(scope = 'session')
+def bot_globals(tmp_path_factory):
+	"""
+	Imports utils.globals from a scratch directory, as it reads the config, queue database and media
+	cache from the working directory as soon as it's imported
+	"""
+
+	with pytest.MonkeyPatch.context() as monkeypatch:
+		monkeypatch.chdir(tmp_path_factory.mktemp('bot'))
+		yield importlib.import_module('utils.globals')
+
+
+@pytest.fixture(autouse = True)
+def workdir(tmp_path, monkeypatch) -> Path:
+	# anything a test writes to the working directory ends up in its own temp dir
+	monkeypatch.chdir(tmp_path)
+	return tmp_path
@@ -0,0 +1,207 @@
+import asyncio
+import json
+from pathlib import Path
+from types import SimpleNamespace
+import importlib
+import httpx
+import pytest
+import utils.backoff
+from utils.delivery import Delivery
+from utils.queue import QueueService, QueueStore
+from utils.scheduler import RateLimitedError
+
+API_URL = 'https://mastodon.test'
+
+
+class FakeMastodon():
+	"""
+	A tiny in-memory Mastodon instance, served through httpx.MockTransport
+
+	Uploads are processed asynchronously (202, then a 206 from the media endpoint until the media is
+	ready), and statuses honour the Idempotency-Key header the same way a real instance does.
+
+	Args
+	----
+	- processing_checks: int
+		- The amount of times the media endpoint returns 206 before the media is ready
+	"""
+
+	def __init__(self, processing_checks: int = 1) -> None:
+		self.processing_checks = processing_checks
+		self.requests: list = []
+		self.media: dict = {}
+		self.statuses: dict = {}
+		self.idempotency_keys: dict = {}
+
+		# status codes to fail the next matching requests with, keyed by (method, path)
+		self.failures: dict = {}
+
+		# the amount of replies to fail, once their status has been posted
+		self.failing_replies = 0
+
+	def count(self, method: str, path: str) -> int:
+		return len([request for request in self.requests if request.method == method and request.url.path == path])
+
+	def handler(self, request: httpx.Request) -> httpx.Response:
+		self.requests.append(request)
+		assert request.headers['Authorization'] == 'Bearer token'
+
+		failures = self.failures.get((request.method, request.url.path))
+		if failures:
+			return httpx.Response(failures.pop(0))
+
+		if request.method == 'POST' and request.url.path == '/api/v2/media':
+			media_id = str(len(self.media) + 1)
+			self.media[media_id] = {'id': media_id, 'url': None, 'checks': 0}
+
+			# the alt text is sent as a multipart field alongside the gif
+			assert b'name="description"' in request.content and b'image/gif' in request.content
+			return httpx.Response(202, json = {'id': media_id, 'url': None})
+
+		if request.method == 'GET' and request.url.path.startswith('/api/v1/media/'):
+			media = self.media[request.url.path.rsplit('/', 1)[-1]]
+			media['checks'] += 1
+
+			if media['checks'] <= self.processing_checks:
+				return httpx.Response(206, json = {'id': media['id'], 'url': None})
+
+			media['url'] = f"{API_URL}/media/{media['id']}.gif"
+			return httpx.Response(200, json = {'id': media['id'], 'url': media['url']})
+
+		if request.method == 'POST' and request.url.path == '/api/v1/statuses':
+			key = request.headers.get('Idempotency-Key')
+			if key in self.idempotency_keys:
+				return httpx.Response(200, json = self.statuses[self.idempotency_keys[key]])
+
+			body = json.loads(request.content)
+			if body.get('in_reply_to_id') and self.failing_replies:
+				self.failing_replies -= 1
+				return httpx.Response(500)
+
+			status_id = str(len(self.statuses) + 100)
+			self.statuses[status_id] = {'id': status_id, 'url': f'{API_URL}/@bot/{status_id}', **body}
+			self.idempotency_keys[key] = status_id
+			return httpx.Response(200, json = self.statuses[status_id])
+
+		return httpx.Response(404)
+
+
+@pytest.fixture(scope = 'module')
+def mastodon(bot_globals):
+	# imported through a fixture, as it needs utils.globals to be imported from a scratch directory first
+	return importlib.import_module('modules.mastodon')
+
+
+@pytest.fixture(autouse = True)
+def no_backoff(monkeypatch):
+	# the fake instance answers straight away, so there's no need to wait between polls
+	monkeypatch.setattr(utils.backoff, 'backoff_delay', lambda *args, **kwargs: 0)
+
+
+@pytest.fixture
+def server(monkeypatch, mastodon):
+	fake = FakeMastodon()
+	client = httpx.AsyncClient(transport = httpx.MockTransport(fake.handler))
+
+	monkeypatch.setattr(mastodon, 'http_manager', SimpleNamespace(client = client))
+	monkeypatch.setattr(mastodon, 'cfg', SimpleNamespace(settings = SimpleNamespace(
+		mastodon = SimpleNamespace(api_url = f'{API_URL}/', access_token = 'token')
+	)))
+
+	yield fake
+
+	asyncio.run(client.aclose())
+
+
+@pytest.fixture
+def queue(tmp_path):
+	return QueueService(QueueStore(tmp_path / 'queue.db'))
+
+
+@pytest.fixture
+def gif(tmp_path) -> Path:
+	path = tmp_path / 'cat.gif'
+	path.write_bytes(b'GIF89a' + b'\x00' * 64)
+	return path
+
+
+def queue_post(queue: QueueService) -> dict:
+	return asyncio.run(queue.enqueue({
+		'original_url': 'https://tenor.com/view/cat.gif',
+		'catbox_url': 'https://files.catbox.moe/abc123.gif',
+		'emoji': '🐱',
+		'caption': 'meow',
+		'alt_text': 'a cat',
+	}))
+
+
+def test_upload_poll_status_reply(mastodon, server, queue, gif):
+	post = queue_post(queue)
+	delivery = Delivery(queue, post['id'], 'mastodon')
+
+	url = asyncio.run(mastodon.post_mastodon(post, gif, delivery))
+
+	# the upload was polled through its 206 before the status went out
+	assert url == f'{API_URL}/@bot/100'
+	assert server.count('POST', '/api/v2/media') == 1
+	assert server.count('GET', '/api/v1/media/1') == 2
+
+	status, reply = server.statuses['100'], server.statuses['101']
+	assert status['status'] == 'meow' and status['media_ids'] == ['1']
+	assert reply['status'] == 'https://files.catbox.moe/abc123.gif - 🐱'
+	assert reply['in_reply_to_id'] == '100'
+	assert set(server.idempotency_keys) == {f"post-{post['id']}", f"reply-{post['id']}"}
+
+	# every step was saved to the queue
+	record = queue.deliveries(post['id'])['mastodon']
+	assert (record['state'], record['media_id'], record['status_id'], record['url']) == ('replied', '1', '100', url)
+
+
+def test_failed_reply_resumes_without_reposting(mastodon, server, queue, gif):
+	post = queue_post(queue)
+	server.failing_replies = 1
+	delivery = Delivery(queue, post['id'], 'mastodon')
+
+	# the upload and status go through, but the reply fails
+	assert asyncio.run(mastodon.post_mastodon(post, gif, delivery)) is False
+	assert queue.deliveries(post['id'])['mastodon']['state'] == 'posted'
+
+	# the next attempt (from the saved record, as it would be after a restart) only sends the reply
+	resumed = Delivery(queue, post['id'], 'mastodon', queue.deliveries(post['id'])['mastodon'])
+	url = asyncio.run(mastodon.post_mastodon(post, gif, resumed))
+
+	assert url == f'{API_URL}/@bot/100'
+	assert server.count('POST', '/api/v2/media') == 1
+	assert len(server.statuses) == 2
+	assert server.statuses['101']['in_reply_to_id'] == '100'
+	assert resumed.complete
+
+
+def test_status_retry_reuses_media_and_idempotency_key(mastodon, server, queue, gif):
+	post = queue_post(queue)
+	server.failures[('POST', '/api/v1/statuses')] = [502]
+	delivery = Delivery(queue, post['id'], 'mastodon')
+
+	# the status fails after the upload, so the media ID is kept for the next attempt
+	assert asyncio.run(mastodon.post_mastodon(post, gif, delivery)) is False
+	assert queue.deliveries(post['id'])['mastodon']['state'] == 'uploaded'
+
+	resumed = Delivery(queue, post['id'], 'mastodon', queue.deliveries(post['id'])['mastodon'])
+	assert asyncio.run(mastodon.post_mastodon(post, gif, resumed)) == f'{API_URL}/@bot/100'
+	assert server.count('POST', '/api/v2/media') == 1
+
+	# a retried status with the same key is answered with the existing one, rather than posting it twice
+	async def repost():
+		return await mastodon.create_status(mastodon.http_manager.client, mastodon.cfg.settings.mastodon, {'Authorization': 'Bearer token'}, {'status': 'meow'}, f"post-{post['id']}")
+
+	assert asyncio.run(repost())['id'] == '100'
+	assert len(server.statuses) == 2
+
+
+def test_rate_limit_is_raised_to_the_scheduler(mastodon, server, queue, gif):
+	post = queue_post(queue)
+	server.failures[('POST', '/api/v2/media')] = [429]
+	delivery = Delivery(queue, post['id'], 'mastodon')
+
+	with pytest.raises(RateLimitedError):
+		asyncio.run(mastodon.post_mastodon(post, gif, delivery))
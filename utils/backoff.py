@@ -0,0 +1,91 @@
+import asyncio
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Optional
+
+
+def backoff_delay(
+	attempt: int,
+	initial: Optional[float] = 1.0,
+	factor: Optional[float] = 2.0,
+	maximum: Optional[float] = 30.0,
+	jitter: Optional[float] = 0.5
+) -> float:
+	"""
+	Returns how long to wait before the given attempt, growing exponentially with some random jitter
+
+	The jitter spreads out callers that started at the same time, so they don't all retry at once.
+
+	Args
+	----
+	- attempt: int
+		- The zero-based attempt number
+	- initial: Optional[float]
+		- The delay before the first attempt, in seconds
+	- factor: Optional[float]
+		- How much the delay grows by with each attempt
+	- maximum: Optional[float]
+		- The largest delay that's able to be returned, in seconds
+	- jitter: Optional[float]
+		- The fraction of the delay that's randomized, i.e 0.5 returns somewhere between 50% and 100% of the delay
+	"""
+
+	delay = min(maximum, initial * (factor ** attempt))
+	return delay * (1 - jitter * random.random())
+
+
+@dataclass(frozen = True, slots = True)
+class PollResult:
+	value: Any
+	elapsed: float
+	attempts: int
+
+
+async def poll(
+	check,
+	deadline: float,
+	initial: Optional[float] = 1.0,
+	factor: Optional[float] = 2.0,
+	maximum: Optional[float] = 30.0,
+	jitter: Optional[float] = 0.5
+) -> PollResult:
+	"""
+	Calls `check` until it returns something other than None, backing off between each call
+
+	Args
+	----
+	- check: Callable
+		- A coroutine function that returns None while whatever is being waited on isn't ready yet
+	- deadline: float
+		- The maximum amount of seconds to wait for, in total
+	- initial, factor, maximum, jitter: Optional[float]
+		- How the delay between calls grows, see `backoff_delay`
+
+	Returns
+	----
+	- PollResult
+		- What `check` returned, how long it took, and how many times it was called
+
+	Raises
+	----
+	- asyncio.TimeoutError
+		- If `check` still hasn't returned anything once the deadline has passed
+	"""
+
+	started_at = time.monotonic()
+	attempt = 0
+
+	while True:
+		value = await check()
+		attempt += 1
+		elapsed = time.monotonic() - started_at
+
+		if value is not None:
+			return PollResult(value = value, elapsed = elapsed, attempts = attempt)
+
+		remaining = deadline - elapsed
+		if remaining <= 0:
+			raise asyncio.TimeoutError(f'Still waiting after {elapsed:.1f} seconds ({attempt} checks)')
+
+		await asyncio.sleep(min(remaining, backoff_delay(attempt - 1, initial, factor, maximum, jitter)))
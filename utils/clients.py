@@ -0,0 +1,72 @@
+import asyncio
+
+
+class ClientRegistry():
+	"""
+	Creates each platform's API client once, and hands the same one out for every post afterwards
+
+	Reusing a client means reusing its HTTP session, so its keep-alive connections (and their TLS
+	handshakes) carry over between posts and retries. A client is only rebuilt once the settings it
+	was created from change, i.e when its credentials are updated in the config file.
+
+	Args
+	----
+	- executor: PlatformExecutor
+		- The executor to construct clients on, as some SDKs make network requests while being constructed
+	"""
+
+	def __init__(self, executor) -> None:
+		self.executor = executor
+		self._factories: dict = {}
+		self._clients: dict = {}
+		self._locks: dict = {}
+
+	def register(self, platform: str, factory) -> None:
+		"""
+		Registers the function used to create a platform's client
+
+		Args
+		----
+		- platform: str
+			- The platform the client belongs to
+		- factory: Callable
+			- A function that takes the platform's settings, and returns its client
+		"""
+
+		self._factories[platform] = factory
+
+	async def get(self, platform: str, settings):
+		"""
+		Returns the client for the given platform, creating it if it doesn't exist or its settings have changed
+
+		Args
+		----
+		- platform: str
+			- The platform to return the client for
+		- settings: Any
+			- The platform's current settings, i.e `cfg.settings.twitter`
+		"""
+
+		# multiple posts/retries asking at once should still only create the client once
+		lock = self._locks.setdefault(platform, asyncio.Lock())
+
+		async with lock:
+			cached = self._clients.get(platform)
+			if cached and cached[0] == settings:
+				return cached[1]
+
+			client = await self.executor.run(platform, self._factories[platform], settings)
+			self._clients[platform] = (settings, client)
+			return client
+
+	def invalidate(self, platform: str) -> None:
+		"""
+		Drops the cached client for the given platform, so the next call to `get` creates a new one
+
+		Args
+		----
+		- platform: str
+			- The platform to drop the client of
+		"""
+
+		self._clients.pop(platform, None)
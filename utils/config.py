@@ -1,12 +1,16 @@
+import atexit
 import json
 import os
+import threading
+from functools import lru_cache
 from pathlib import Path
 from typing import Union, Final, Optional
+from utils.settings import Settings, build_settings
 
 # Default configuration file
 DEFAULT_CFG: Final = {
 	"userhash": "catbox.moe userhash",
-	"queue": [],
+	"media_cache_size": 200,
 	"discord": {
 		"token": "",
 		"post_notifs": {
@@ -31,14 +35,17 @@ DEFAULT_CFG: Final = {
 		"consumer_key": "",
 		"consumer_secret": "",
 		"access_token": "",
-		"access_token_secret": ""
+		"access_token_secret": "",
+		"bearer_token": ""
 	},
 	"tumblr": {
 		"enabled": False,
 		"consumer_key": "",
 		"consumer_secret": "",
 		"oauth_token": "",
-		"oauth_secret": ""
+		"oauth_secret": "",
+		"blog_name": "",
+		"use_catbox_url": False
 	},
 	"mastodon": {
 		"enabled": False,
@@ -51,10 +58,56 @@ DEFAULT_CFG: Final = {
 
 
 class Config():
-	def __init__(self, path: Union[str, os.PathLike, Path]) -> None:
+	"""
+	In-memory config store with debounced, atomic write-behind persistence
+
+	Reads are served straight from memory. Mutations mark the store as dirty, and
+	are written to disk in a single batch once either `flush_interval` seconds have
+	passed, or `flush_threshold` mutations have been made (whichever comes first).
+
+	In journaled mode, each mutation is instead appended to a log file next to the config
+	as a JSON patch operation. The log is replayed when the config is loaded, and is folded
+	back into the config file once it grows past `compact_threshold` bytes.
+
+	Args
+	----
+	- path: Union[str, os.PathLike, Path]
+		- The path to the config file
+	- flush_interval: Optional[float]
+		- The amount of seconds to wait after a mutation before flushing to disk
+	- flush_threshold: Optional[int]
+		- The amount of pending mutations that forces an immediate flush
+	- journal: Optional[bool]
+		- Whether or not to append mutations to a journal rather than rewriting the whole file
+	- compact_threshold: Optional[int]
+		- The size in bytes the journal is able to reach before it's compacted into the config file
+	"""
+
+	def __init__(
+		self,
+		path: Union[str, os.PathLike, Path],
+		flush_interval: Optional[float] = 5.0,
+		flush_threshold: Optional[int] = 50,
+		journal: Optional[bool] = False,
+		compact_threshold: Optional[int] = 65536
+	) -> None:
 		self.cfg_path: Path = Path(path)
+		self.journal_path: Path = self.cfg_path.with_name(f'{self.cfg_path.name}.journal')
+		self.flush_interval = flush_interval
+		self.flush_threshold = flush_threshold
+		self.journal = journal
+		self.compact_threshold = compact_threshold
+
+		self._lock = threading.RLock()
+		self._pending = 0
+		self._timer: Optional[threading.Timer] = None
+		self._settings: Optional[Settings] = None
+
 		self.config: dict = self.load_config(path)
 
+		# make sure nothing pending is lost when the process exits
+		atexit.register(self.flush)
+
 	def load_config(self, path: Union[str, os.PathLike, Path]) -> dict:
 		"""
 		Loads the config file from the specified path
@@ -86,8 +139,12 @@ class Config():
 		# merge newly loaded config file with default config
 		self.config = deep_merge(DEFAULT_CFG, config)
 
+		# apply any changes that were journaled since the config file was last written
+		self.replay_journal()
+
 		# write config file to disk
 		self.write_config()
+		self.truncate_journal()
 
 		# return the config file
 		return self.config
@@ -109,48 +166,226 @@ class Config():
 		separators = None if format == 'pretty' else (',', ':')
 
 		path = self.cfg_path
+		tmp_path = path.with_name(f'{path.name}.tmp')
 
-		# if the path doesn't exist, create it
-		if not path.exists():
-			path.touch()
+		# write to a temporary file first, then swap it in place of the real one
+		# this way, a crash mid-write can never leave us with a half written config
+		with self._lock:
+			data = json.dumps(self.config, indent=indent_level, separators=separators, sort_keys=sort_keys)
 
-		# write the config file
-		with open(path, 'w', encoding='utf8') as f:
-			f.write(json.dumps(self.config, indent=indent_level, separators=separators, sort_keys=sort_keys))
+			with open(tmp_path, 'w', encoding='utf8') as f:
+				f.write(data)
+				f.flush()
+				os.fsync(f.fileno())
 
-	def getter(self, key, obj = None):
-		keys = key.split('.')
+			os.replace(tmp_path, path)
+
+	def append_journal(self, op: str, keys: tuple, value = None) -> None:
+		"""
+		Appends a single JSON patch operation to the journal, compacting it if it has grown too large
+
+		Args
+		----
+		- op: str
+			- The operation, either 'replace' or 'remove'
+		- keys: tuple
+			- The compiled key the operation applies to
+		- value: Any
+			- The value to set (only used for 'replace')
+		"""
+
+		record = {'op': op, 'path': '/' + '/'.join(part.replace('~', '~0').replace('/', '~1') for part in keys)}
+		if op == 'replace':
+			record['value'] = value
+
+		with self._lock:
+			with open(self.journal_path, 'a', encoding='utf8') as f:
+				f.write(json.dumps(record, separators=(',', ':')) + '\n')
+				f.flush()
+				os.fsync(f.fileno())
+				size = f.tell()
+
+			if size >= self.compact_threshold:
+				self.compact()
+
+	def replay_journal(self) -> None:
+		"""
+		Applies every operation within the journal to the loaded config
+		"""
+
+		if not self.journal_path.exists():
+			return
+
+		with open(self.journal_path, 'r', encoding='utf8') as f:
+			for line in f:
+				# a crash mid-append can leave a partial record at the end, which we skip
+				try:
+					record = json.loads(line)
+				except json.JSONDecodeError:
+					continue
+
+				keys = tuple(part.replace('~1', '/').replace('~0', '~') for part in record['path'][1:].split('/'))
+
+				if record['op'] == 'replace':
+					self.config = self.setter('.'.join(keys), record['value'], self.config)
+				elif record['op'] == 'remove':
+					self.remover(keys)
+
+	def truncate_journal(self) -> None:
+		"""
+		Empties the journal, once everything within it is part of the config file
+		"""
+
+		with self._lock:
+			if self.journal_path.exists():
+				open(self.journal_path, 'w').close()
+
+	def compact(self) -> None:
+		"""
+		Folds the journal into a fresh copy of the config file
+		"""
+
+		# the config file is written before the journal is emptied,
+		# as replaying operations that are already applied is harmless
+		with self._lock:
+			self.write_config()
+			self.truncate_journal()
+
+	def flush(self) -> None:
+		"""
+		Writes any pending mutations to disk immediately
+		"""
+
+		with self._lock:
+			if self.journal:
+				if self.journal_path.exists() and self.journal_path.stat().st_size > 0:
+					self.compact()
+
+				return
+
+			if self._timer:
+				self._timer.cancel()
+				self._timer = None
+
+			if self._pending == 0:
+				return
+
+			self.write_config()
+			self._pending = 0
+
+	def mark_dirty(self) -> None:
+		"""
+		Records a mutation, flushing now if enough have built up, or scheduling a flush otherwise
+		"""
+
+		with self._lock:
+			self._pending += 1
+
+			if self._pending >= self.flush_threshold:
+				return self.flush()
 
-		if not obj or not isinstance(obj, dict):
-			return None
+			if not self._timer:
+				self._timer = threading.Timer(self.flush_interval, self.flush)
+				self._timer.daemon = True
+				self._timer.start()
 
-		if len(keys) == 1:
-			return obj.get(key)
+	@property
+	def settings(self) -> Settings:
+		"""
+		An immutable snapshot of the current config, rebuilt only after the config has changed
+		"""
+
+		settings = self._settings
+		if settings is None:
+			with self._lock:
+				if self._settings is None:
+					self._settings = build_settings(self.config)
+
+				settings = self._settings
+
+		return settings
+
+	def getter(self, key, obj = None):
+		for part in compile_key(key):
+			if not obj or not isinstance(obj, dict):
+				return None
+
+			obj = obj.get(part)
 
-		new_key = keys[1:]
-		return self.getter('.'.join(new_key), obj.get(keys[0]))
+		return obj
 
 	def setter(self, key, value, obj):
-		keys = key.split('.')
+		keys = compile_key(key)
+		parent = obj
 
-		if len(keys) == 1:
-			obj[key] = value
-			return obj
-		else:
-			newKey = keys[0]
-			obj[newKey] = self.setter('.'.join(keys[1:]), value, obj.get(newKey))
+		# walk down to the parent of the key we're setting, creating any missing objects along the way
+		for part in keys[:-1]:
+			child = parent.get(part)
+			if not isinstance(child, dict):
+				child = parent[part] = {}
+
+			parent = child
 
-			return obj
+		parent[keys[-1]] = value
+		return obj
 
 	def get(self, key):
-		self.config = deep_merge(DEFAULT_CFG, self.config)
-		self.write_config()
 		return self.getter(key, self.config)
 
+	def remover(self, keys: tuple) -> bool:
+		parent = self.config
+		for part in keys[:-1]:
+			parent = parent.get(part)
+			if not isinstance(parent, dict):
+				return False
+
+		if keys[-1] not in parent:
+			return False
+
+		del parent[keys[-1]]
+		return True
+
 	def set(self, key, value):
-		self.config = deep_merge(DEFAULT_CFG, self.config)
-		self.config = self.setter(key, value, self.config)
-		self.write_config()
+		with self._lock:
+			self.config = self.setter(key, value, self.config)
+			self._settings = None
+
+			if self.journal:
+				self.append_journal('replace', compile_key(key), value)
+			else:
+				self.mark_dirty()
+
+	def delete(self, key):
+		with self._lock:
+			keys = compile_key(key)
+			if not self.remover(keys):
+				return
+
+			self._settings = None
+
+			if self.journal:
+				self.append_journal('remove', keys)
+			else:
+				self.mark_dirty()
+
+
+@lru_cache(maxsize = 1024)
+def compile_key(key: str) -> tuple:
+	"""
+	Parses a dotted config key into a tuple of its parts, caching the result so each key is only split once
+
+	Args
+	----
+	- key: str
+		- The dotted key to parse, i.e `discord.embed_colors.error`
+
+	Returns
+	----
+	- tuple
+		- The parts of the key, i.e `('discord', 'embed_colors', 'error')`
+	"""
+
+	return tuple(key.split('.'))
 
 
 def deep_merge(obj1, obj2):
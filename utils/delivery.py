@@ -0,0 +1,142 @@
+from typing import Optional
+
+
+class Delivery():
+	"""
+	Tracks the progress of a single post on a single platform, saving every step to the queue database
+
+	A delivery moves through `pending` -> `uploaded` (the gif has a media ID) -> `posted` (the post
+	exists) -> `replied` (the reply with the gif URL exists, and the delivery is complete). A failed
+	attempt moves it to `failed`, but whatever it got done before failing is kept, so the next attempt
+	is able to reuse the uploaded media ID (or only send the reply) rather than starting over.
+
+	An attempt that's deferred (the platform is rate limited, or its circuit breaker is open) doesn't
+	count as an attempt, but is counted separately, so a platform that stays unavailable is still
+	given up on eventually.
+
+	Args
+	----
+	- queue: QueueService
+		- The queue to save the delivery to
+	- post_id: int
+		- The ID of the post being delivered
+	- platform: str
+		- The platform the post is being delivered to
+	- record: Optional[dict]
+		- The previously saved record of this delivery, if there is one
+	"""
+
+	def __init__(self, queue, post_id: int, platform: str, record: Optional[dict] = None) -> None:
+		self.queue = queue
+		self.record = {
+			'post_id': post_id,
+			'platform': platform,
+			'state': 'pending',
+			'media_id': None,
+			'status_id': None,
+			'url': None,
+			'attempts': 0,
+			'deferrals': 0,
+			'error': None,
+			**(record or {}),
+		}
+
+	@property
+	def platform(self) -> str:
+		return self.record['platform']
+
+	@property
+	def state(self) -> str:
+		return self.record['state']
+
+	@property
+	def media_id(self) -> Optional[str]:
+		return self.record['media_id']
+
+	@property
+	def status_id(self) -> Optional[str]:
+		return self.record['status_id']
+
+	@property
+	def url(self) -> Optional[str]:
+		return self.record['url']
+
+	@property
+	def attempts(self) -> int:
+		return self.record['attempts']
+
+	@property
+	def deferrals(self) -> int:
+		return self.record['deferrals']
+
+	@property
+	def error(self) -> Optional[str]:
+		return self.record['error']
+
+	@property
+	def complete(self) -> bool:
+		"""
+		Whether or not the post has fully gone out on this platform
+		"""
+
+		return self.state == 'replied'
+
+	def exhausted(self, max_attempts: int, max_deferrals: int) -> bool:
+		"""
+		Whether or not the delivery has failed or been deferred too many times, and should be given up on
+
+		Args
+		----
+		- max_attempts: int
+			- The maximum amount of attempts
+		- max_deferrals: int
+			- The maximum amount of deferred attempts
+		"""
+
+		return not self.complete and (self.attempts >= max_attempts or self.deferrals >= max_deferrals)
+
+	async def _save(self, **changes) -> None:
+		self.record.update(changes)
+		await self.queue.save_delivery(self.record)
+
+	async def attempt(self) -> None:
+		"""
+		Records that an attempt at delivering the post has started
+		"""
+
+		await self._save(attempts = self.attempts + 1, error = None)
+
+	async def uploaded(self, media_id: str) -> None:
+		"""
+		Records that the gif has been uploaded (and processed), and is able to be attached to a post
+		"""
+
+		await self._save(state = 'uploaded', media_id = str(media_id))
+
+	async def posted(self, status_id: str, url: str) -> None:
+		"""
+		Records that the post itself has gone out
+		"""
+
+		await self._save(state = 'posted', status_id = str(status_id), url = url)
+
+	async def replied(self) -> None:
+		"""
+		Records that the reply has gone out (or that the platform doesn't need one), completing the delivery
+		"""
+
+		await self._save(state = 'replied')
+
+	async def deferred(self, reason: str) -> None:
+		"""
+		Records that the attempt was put off until later (i.e the platform is rate limited), so it counts as a deferral rather than an attempt
+		"""
+
+		await self._save(attempts = max(0, self.attempts - 1), deferrals = self.deferrals + 1, error = reason)
+
+	async def failed(self, error: str) -> None:
+		"""
+		Records that the attempt failed, keeping anything it managed to get done
+		"""
+
+		await self._save(state = 'failed', error = error)
@@ -0,0 +1,121 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+
+class PlatformExecutor():
+	"""
+	Runs blocking platform SDK calls on dedicated thread pools, so that they never block the event loop
+
+	Each platform gets its own fixed size pool, meaning a slow upload to one platform is never
+	able to starve the others of threads. Every call records how long it sat waiting for a free
+	thread, and how long it actually took to run, so that the pool sizes are able to be tuned.
+
+	Args
+	----
+	- pool_sizes: dict
+		- The amount of threads to give each platform, i.e `{'twitter': 2}`
+	- logger: Optional[Logger]
+		- The logger to report call timings to
+	- default_pool_size: Optional[int]
+		- The amount of threads to give any platform not in `pool_sizes`
+	"""
+
+	def __init__(self, pool_sizes: dict, logger = None, default_pool_size: Optional[int] = 2) -> None:
+		self.pool_sizes = pool_sizes
+		self.default_pool_size = default_pool_size
+		self.log = logger
+
+		self._pools: dict = {}
+		self.stats: dict = {}
+
+	def pool(self, platform: str) -> ThreadPoolExecutor:
+		"""
+		Returns the thread pool for the given platform, creating it if it doesn't exist yet
+
+		Args
+		----
+		- platform: str
+			- The platform to return the pool for
+		"""
+
+		if platform not in self._pools:
+			self._pools[platform] = ThreadPoolExecutor(
+				max_workers = self.pool_sizes.get(platform, self.default_pool_size),
+				thread_name_prefix = f'{platform}-sdk'
+			)
+
+		return self._pools[platform]
+
+	async def run(self, platform: str, func, *args, **kwargs):
+		"""
+		Runs a blocking function on the given platform's thread pool, and waits for its result
+
+		Args
+		----
+		- platform: str
+			- The platform the call belongs to
+		- func: Callable
+			- The blocking function to run
+		- *args, **kwargs
+			- The arguments to call the function with
+
+		Returns
+		----
+		- Any
+			- Whatever the function returned
+		"""
+
+		loop = asyncio.get_running_loop()
+		submitted_at = time.perf_counter()
+		timings = {'wait': 0.0, 'exec': 0.0}
+
+		def call():
+			started_at = time.perf_counter()
+			timings['wait'] = started_at - submitted_at
+
+			try:
+				return func(*args, **kwargs)
+			finally:
+				timings['exec'] = time.perf_counter() - started_at
+
+		try:
+			return await loop.run_in_executor(self.pool(platform), call)
+		finally:
+			self.record(platform, getattr(func, '__name__', repr(func)), timings['wait'], timings['exec'])
+
+	def record(self, platform: str, name: str, wait: float, exec: float) -> None:
+		"""
+		Records the timings of a single call
+
+		Args
+		----
+		- platform: str
+			- The platform the call belongs to
+		- name: str
+			- The name of the function that was called
+		- wait: float
+			- The amount of seconds the call waited for a free thread
+		- exec: float
+			- The amount of seconds the call took to run
+		"""
+
+		stats = self.stats.setdefault(platform, {'calls': 0, 'wait': 0.0, 'exec': 0.0, 'max_wait': 0.0})
+		stats['calls'] += 1
+		stats['wait'] += wait
+		stats['exec'] += exec
+		stats['max_wait'] = max(stats['max_wait'], wait)
+
+		if self.log:
+			self.log.info(f'[{platform}] {name} waited {wait:.2f}s for a thread, ran for {exec:.2f}s')
+
+	def shutdown(self) -> None:
+		"""
+		Shuts down every thread pool, without waiting for any running calls to finish
+		"""
+
+		for pool in self._pools.values():
+			pool.shutdown(wait = False, cancel_futures = True)
+
+		self._pools.clear()
@@ -1,53 +1,53 @@
 import traceback
 import discord
 from typing import Optional, Union
-from utils.globals import cfg, log
+from utils.globals import cfg, log, post_queue
 
-def remove_post(post):
+async def remove_post(post):
 	"""
 	Removes a post from the queue
 
 	Args
 	----
 		- post (dict): The post to remove
+
+	Returns
+	----
+		- bool: Whether or not the post was still in the queue
 	"""
 
-	queue = cfg.get('queue')
-	queue.remove(post)
-	cfg.set('queue', queue)
+	return await post_queue.remove(post['id'])
 
 
-def edit_post(post, args):
+async def edit_post(post, args):
 	"""
 	Edits a post in the queue
 
+	The edit only goes through if nobody else has changed the post since it was fetched.
+	On success, the given post is updated in place, so any views holding it stay current.
+
 	Args
 	----
 		- post (dict): The post to edit
 		- args (dict): The arguments to edit the post with
 			- caption (str): The caption to set on the post
 			- alt_text (str): The alt text to set on the post
-	"""
 
-	queue = cfg.get('queue')
-	have_found_post = False
-	found_post = None
-	for tmpPost in queue:
-		if tmpPost["catbox_url"] == post['catbox_url']:
-			have_found_post = True
-			found_post = tmpPost
-			break
+	Returns
+	----
+		- bool: Whether or not the post was edited
+	"""
 
-	if have_found_post:
-		post_index = queue.index(found_post)
+	edited = await post_queue.update(post['id'], {
+		'caption': args.get('caption', ''),
+		'alt_text': args.get('alt_text', ''),
+	}, post.get('version'))
 
-		if args.get('caption', '') == '':
-			del queue[post_index]['caption']
-		else:
-			queue[post_index]["caption"] = args.get('caption', '')
+	if not edited:
+		return False
 
-		queue[post_index]["alt_text"] = args.get('alt_text', '')
-		cfg.set('queue', queue)
+	post.update(edited)
+	return True
 
 
 def create_embed(title: str, description: str, color: str):
@@ -65,7 +65,7 @@ def create_embed(title: str, description: str, color: str):
 	return discord.Embed(
 		title=title,
 		description=description,
-		color=discord.Color.from_str(cfg.get(f'discord.embed_colors.{color}'))
+		color=discord.Color.from_str(getattr(cfg.settings.discord.embed_colors, color))
 	)
 
 
@@ -78,7 +78,7 @@ def is_user_authorized(user_id: Union[int, str], bot_info: discord.AppInfo):
 		- user_id (int): The user ID to check
 		- bot_info (discord.AppInfo): The bot's application info
 	"""
-	return str(user_id) in cfg.get('discord.authed_users') or user_id == bot_info.owner.id
+	return str(user_id) in cfg.settings.discord.authed_users or user_id == bot_info.owner.id
 
 
 async def error_response(interaction: discord.Interaction, error, command_name):
@@ -123,17 +123,17 @@ async def handle_base_response(
 		case "success":
 			embed.title = "Success"
 			embed.color = discord.Color.from_str(
-				cfg.get('discord.embed_colors.success')
+				cfg.settings.discord.embed_colors.success
 			)
 		case "info":
 			embed.title = "Info"
 			embed.color = discord.Color.from_str(
-				cfg.get('discord.embed_colors.info')
+				cfg.settings.discord.embed_colors.info
 			)
 		case "error":
 			embed.title = "Error"
 			embed.color = discord.Color.from_str(
-				cfg.get('discord.embed_colors.error')
+				cfg.settings.discord.embed_colors.error
 			)
 
 	# set img url if present
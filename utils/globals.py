@@ -1,6 +1,16 @@
 from typing import Final
+from utils.clients import ClientRegistry
 from utils.config import Config
+from utils.executor import PlatformExecutor
+from utils.http import HttpManager
+from utils.ingest import IngestPool
 from utils.logger import Logger
+from utils.media_cache import MediaCache
+from utils.notifier import WebhookNotifier
+from utils.prefetch import Prefetcher
+from utils.queue import QueueService, QueueStore
+from utils.runner import JobRunner
+from utils.scheduler import PublishScheduler
 
 # ---- Regexes ---- #
 # Regex to find the raw gif URL from a Tenor URL (they provide a link to a page with the gif embedded within the HTML)
@@ -11,11 +21,34 @@ CLEAN_URL_REGEX = r"\?.*$" # Regex to remove all parameters from a URL (solely u
 
 # ---- Misc ---- #
 POST_HR_INTERVAL = 4
+PUBLISH_TIMEOUT = 600 # Maximum amount of seconds posting to a single platform is able to take
+POST_JOB_TIMEOUT = 1800 # Maximum amount of seconds a whole post cycle is able to take
+MAX_DELIVERY_ATTEMPTS = 3 # Maximum amount of post cycles a single platform is attempted for before a post gives up on it
+MAX_DELIVERY_DEFERRALS = 6 # Maximum amount of post cycles a single platform is able to be deferred for (i.e rate limited) before a post gives up on it
+MEDIA_PROCESSING_TIMEOUT = 300 # Maximum amount of seconds to wait for a platform to finish processing an uploaded gif
 GIF_SIZE_LIMIT = 10000000 # Mastodon's file size limit is 10MB
 CATBOX_URL = "https://catbox.moe/user/api.php" # Catbox.moe API URL
+BULK_MAX_ITEMS = 50 # Maximum amount of gifs that are able to be queued with a single /tweet_bulk
+BULK_CONCURRENCY = 5 # Maximum amount of gifs from a /tweet_bulk that are processed at once
+INGEST_WORKERS = 8 # Maximum amount of submitted gifs that are resolved, validated and uploaded at once
+INGEST_STAGE_TIMEOUT = 30 # Maximum amount of seconds a single stage of processing a submitted gif is able to take
+CATBOX_UPLOAD_TIMEOUT = 120 # Maximum amount of seconds catbox.moe is given to upload a submitted gif
+PREFETCH_DEPTH = 2 # Amount of gifs at the head of the queue that are downloaded ahead of time
 CAT_HASHTAGS = ['gifkitties', 'cat', 'catlife', 'catlove', 'catlover', 'catlovers', 'catoftheday', 'cats', 'catsoftheworld', 'catgif', 'catgifs', 'gifs', 'gif'] # Cat related hashtags
-cfg = Config(path = "config.json") # Config class instance
+cfg = Config(path = "config.json", journal = True) # Config class instance
 log = Logger() # Logger
+post_queue = QueueService(QueueStore(path = "queue.db")) # Post queue
+executor = PlatformExecutor(pool_sizes = {"twitter": 2}, logger = log) # Thread pools for blocking platform SDK calls
+http_manager = HttpManager() # Shared HTTP clients
+clients = ClientRegistry(executor = executor) # Long-lived platform API clients
+notifier = WebhookNotifier(http = http_manager, logger = log) # Sends Discord webhook messages in the background
+post_runner = JobRunner(name = "post", timeout = POST_JOB_TIMEOUT, logger = log) # Runs each post cycle in the background
+publish_scheduler = PublishScheduler(cooldown = POST_HR_INTERVAL * 60 * 60, logger = log) # Rate limits, retries and circuit breakers for each platform (a tripped breaker sits out the next cycle)
+ingest_pool = IngestPool(workers = INGEST_WORKERS, stage_timeout = INGEST_STAGE_TIMEOUT, logger = log) # Processes submitted gifs in the background
+
+# Move the queue out of the config file if it's still stored there
+if (migrated := post_queue.store.migrate_from_config(cfg)):
+	log.info(f"Migrated {migrated} posts from config.json to queue.db")
 
 
 # ---- Webhook information ---- #
@@ -40,3 +73,11 @@ BASE_HEADERS: Final = {
 	"Accept-Encoding": "gzip, deflate, br",
 	"Connection": "keep-alive",
 }
+
+
+# ---- Media ---- #
+# Local cache of downloaded gifs, keyed by their contents, which every post reads from
+media_cache = MediaCache(http = http_manager, directory = "media", budget = cfg.settings.media_cache_size * 1024 * 1024, size_limit = GIF_SIZE_LIMIT, headers = BASE_HEADERS, logger = log)
+
+# Downloads the next few gifs in the queue into the media cache ahead of their post time
+prefetcher = Prefetcher(queue = post_queue, cache = media_cache, depth = PREFETCH_DEPTH, logger = log)
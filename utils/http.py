@@ -0,0 +1,283 @@
+import hashlib
+import os
+import time
+import weakref
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Union
+import aiohttp
+import httpx
+
+# HTTP/2 support in httpx needs the optional `h2` package
+try:
+	import h2 # noqa: F401
+	HTTP2_AVAILABLE = True
+except ImportError:
+	HTTP2_AVAILABLE = False
+
+
+class FileTooLargeError(Exception):
+	"""
+	Raised when a download is aborted for going over its size limit
+	"""
+
+
+@dataclass(frozen = True, slots = True)
+class Download:
+	status_code: int
+	size: int
+	sha256: str
+	path: Optional[Path]
+
+
+class HttpManager():
+	"""
+	Application-wide HTTP clients, shared by every command and the post loop
+
+	Sharing one client means connections to the hosts we talk to over and over (tenor, giphy, catbox)
+	are kept alive and reused, rather than being opened (and TLS negotiated) for every request.
+	The clients are created when the bot starts, and closed when it shuts down.
+
+	Per-host request counts, new connections and latency are recorded for every request made
+	through the httpx client, and are able to be read through `stats()`.
+
+	Args
+	----
+	- max_connections: Optional[int]
+		- The maximum amount of connections open at once, across all hosts
+	- max_keepalive_connections: Optional[int]
+		- The maximum amount of idle connections kept alive, across all hosts
+	- max_connections_per_host: Optional[int]
+		- The maximum amount of connections the aiohttp session opens to a single host
+	- keepalive_expiry: Optional[float]
+		- The amount of seconds an idle connection is kept alive for
+	- timeout: Optional[float]
+		- The default timeout for requests, in seconds
+	"""
+
+	def __init__(
+		self,
+		max_connections: Optional[int] = 50,
+		max_keepalive_connections: Optional[int] = 20,
+		max_connections_per_host: Optional[int] = 10,
+		keepalive_expiry: Optional[float] = 60.0,
+		timeout: Optional[float] = 30.0
+	) -> None:
+		self.max_connections = max_connections
+		self.max_keepalive_connections = max_keepalive_connections
+		self.max_connections_per_host = max_connections_per_host
+		self.keepalive_expiry = keepalive_expiry
+		self.timeout = timeout
+
+		self._client: Optional[httpx.AsyncClient] = None
+		self._session: Optional[aiohttp.ClientSession] = None
+		self._started_at = weakref.WeakKeyDictionary()
+		self._stats: dict = {}
+
+	async def start(self) -> None:
+		"""
+		Creates the shared clients
+		"""
+
+		if not self._client or self._client.is_closed:
+			self._client = httpx.AsyncClient(
+				http2 = HTTP2_AVAILABLE,
+				timeout = self.timeout,
+				limits = httpx.Limits(
+					max_connections = self.max_connections,
+					max_keepalive_connections = self.max_keepalive_connections,
+					keepalive_expiry = self.keepalive_expiry,
+				),
+				event_hooks = {
+					'request': [self._on_request],
+					'response': [self._on_response],
+				},
+			)
+
+		if not self._session or self._session.closed:
+			self._session = aiohttp.ClientSession(
+				connector = aiohttp.TCPConnector(
+					limit = self.max_connections,
+					limit_per_host = self.max_connections_per_host,
+					keepalive_timeout = self.keepalive_expiry,
+				)
+			)
+
+	async def close(self) -> None:
+		"""
+		Closes the shared clients, along with every connection they have open
+		"""
+
+		if self._client:
+			await self._client.aclose()
+			self._client = None
+
+		if self._session:
+			await self._session.close()
+			self._session = None
+
+	@property
+	def client(self) -> httpx.AsyncClient:
+		"""
+		The shared httpx client, used for everything other than Discord webhooks
+		"""
+
+		if not self._client or self._client.is_closed:
+			raise RuntimeError('The HTTP manager has not been started')
+
+		return self._client
+
+	@property
+	def session(self) -> aiohttp.ClientSession:
+		"""
+		The shared aiohttp session, used for Discord webhooks (as discord.py requires one)
+		"""
+
+		if not self._session or self._session.closed:
+			raise RuntimeError('The HTTP manager has not been started')
+
+		return self._session
+
+	def _host_stats(self, host: str) -> dict:
+		return self._stats.setdefault(host, {
+			'requests': 0,
+			'new_connections': 0,
+			'errors': 0,
+			'total_latency': 0.0,
+			'max_latency': 0.0,
+		})
+
+	async def _on_request(self, request: httpx.Request) -> None:
+		self._started_at[request] = time.perf_counter()
+		host = request.url.host
+
+		# httpcore reports every new connection it opens through its trace extension,
+		# which tells us how often requests are actually reusing a kept-alive connection
+		async def trace(event_name: str, info: dict) -> None:
+			if event_name == 'connection.connect_tcp.complete':
+				self._host_stats(host)['new_connections'] += 1
+
+		request.extensions['trace'] = trace
+
+	async def _on_response(self, response: httpx.Response) -> None:
+		started_at = self._started_at.pop(response.request, None)
+		stats = self._host_stats(response.request.url.host)
+		stats['requests'] += 1
+
+		if response.status_code >= 400:
+			stats['errors'] += 1
+
+		if started_at is not None:
+			latency = time.perf_counter() - started_at
+			stats['total_latency'] += latency
+			stats['max_latency'] = max(stats['max_latency'], latency)
+
+	def stats(self) -> dict:
+		"""
+		Returns the request, connection and latency stats for every host that has been requested
+
+		Returns
+		----
+		- dict
+			- Stats keyed by host, i.e `{'catbox.moe': {'requests': 4, 'new_connections': 1, ...}}`
+		"""
+
+		return {
+			host: {
+				**stats,
+				'avg_latency': stats['total_latency'] / stats['requests'] if stats['requests'] else 0.0,
+			}
+			for host, stats in self._stats.items()
+		}
+
+	def format_stats(self) -> str:
+		"""
+		Formats the per-host stats as one line per host, for logging
+		"""
+
+		return '\n'.join(
+			f"{host}: {stats['requests']} requests, {stats['new_connections']} new connections, "
+			f"{stats['errors']} errors, {stats['avg_latency'] * 1000:.0f}ms avg / {stats['max_latency'] * 1000:.0f}ms max latency"
+			for host, stats in self.stats().items()
+		)
+
+	async def download(
+		self,
+		url: str,
+		dest: Optional[Union[str, os.PathLike, Path]] = None,
+		limit: Optional[int] = None,
+		headers: Optional[dict] = None,
+		chunk_size: Optional[int] = 65536
+	) -> Download:
+		"""
+		Streams a file to disk chunk by chunk, hashing it as it arrives
+
+		Only a single chunk is ever held in memory, no matter how large the file is. If the file goes over
+		`limit`, the download is aborted as soon as that's known (either from the Content-Length header or
+		from the bytes received so far), and nothing is left behind on disk.
+
+		Args
+		----
+		- url: str
+			- The URL to download
+		- dest: Optional[Union[str, os.PathLike, Path]]
+			- Where to write the file, or None to only measure and hash it
+		- limit: Optional[int]
+			- The maximum size of the file in bytes
+		- headers: Optional[dict]
+			- The headers to send with the request
+		- chunk_size: Optional[int]
+			- The size of each chunk read from the response, in bytes
+
+		Returns
+		----
+		- Download
+			- The status code, size and sha256 of the file, and where it was written
+			- If the status code isn't 200, nothing is written
+
+		Raises
+		----
+		- FileTooLargeError
+			- If the file is larger than `limit`
+		"""
+
+		dest = Path(dest) if dest else None
+		tmp_path = dest.with_name(f'{dest.name}.part') if dest else None
+
+		async with self.client.stream('GET', url, headers = headers) as res:
+			if res.status_code != 200:
+				return Download(status_code = res.status_code, size = 0, sha256 = '', path = None)
+
+			content_length = res.headers.get('content-length')
+			if limit is not None and content_length and content_length.isdigit() and int(content_length) > limit:
+				raise FileTooLargeError(f'{url} is {content_length} bytes, which is over the limit of {limit} bytes')
+
+			sha256 = hashlib.sha256()
+			size = 0
+			f = open(tmp_path, 'wb') if tmp_path else None
+
+			try:
+				async for chunk in res.aiter_bytes(chunk_size):
+					size += len(chunk)
+					if limit is not None and size > limit:
+						raise FileTooLargeError(f'{url} is over the limit of {limit} bytes')
+
+					sha256.update(chunk)
+					if f:
+						f.write(chunk)
+
+				if f:
+					f.flush()
+					os.fsync(f.fileno())
+			except BaseException:
+				if f:
+					f.close()
+					tmp_path.unlink(missing_ok = True)
+
+				raise
+
+			if f:
+				f.close()
+				os.replace(tmp_path, dest)
+
+		return Download(status_code = res.status_code, size = size, sha256 = sha256.hexdigest(), path = dest)
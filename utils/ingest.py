@@ -0,0 +1,203 @@
+import asyncio
+import traceback
+from typing import Optional
+
+
+class StageTimeoutError(Exception):
+	"""
+	Raised when a single stage of an ingestion job takes longer than it's allowed to
+
+	Args
+	----
+	- stage: str
+		- The description of the stage that timed out
+	- timeout: float
+		- The amount of seconds the stage was given
+	"""
+
+	def __init__(self, stage: str, timeout: float) -> None:
+		super().__init__(f'"{stage}" timed out after {timeout:.0f} seconds')
+		self.stage = stage
+		self.timeout = timeout
+
+
+class IngestJob():
+	"""
+	The handle a pipeline is given while it's being run by the ingestion pool
+
+	Args
+	----
+	- progress: Optional[Callable]
+		- A coroutine function that's called with the description of each stage as it starts
+	- stage_timeout: float
+		- The default amount of seconds a single stage is able to take
+	- logger: Optional[Logger]
+		- The logger to report progress errors to
+	"""
+
+	def __init__(self, progress = None, stage_timeout: float = 60.0, logger = None) -> None:
+		self.progress = progress
+		self.stage_timeout = stage_timeout
+		self.log = logger
+
+	async def report(self, description: str) -> None:
+		"""
+		Reports the job's progress, making sure a failed report (i.e a discord edit failing) doesn't fail the job
+		"""
+
+		if not self.progress:
+			return
+
+		try:
+			await self.progress(description)
+		except Exception:
+			if self.log:
+				self.log.warning(f"Unable to report the progress of an ingestion job\n{traceback.format_exc()}")
+
+	async def stage(self, description: str, coro, timeout: Optional[float] = None, report: Optional[bool] = True):
+		"""
+		Runs a single stage of the job, reporting it first and giving it its own timeout
+
+		Args
+		----
+		- description: str
+			- What the stage is doing, i.e `Uploading the gif to catbox.moe...`
+		- coro: Awaitable
+			- The stage itself
+		- timeout: Optional[float]
+			- The amount of seconds the stage is able to take, if it's different from the default
+		- report: Optional[bool]
+			- Whether or not to report the stage (stages run alongside each other are better reported together)
+
+		Returns
+		----
+		- Any
+			- Whatever the stage returned
+
+		Raises
+		----
+		- StageTimeoutError
+			- If the stage took too long
+		"""
+
+		timeout = timeout or self.stage_timeout
+		if report:
+			await self.report(description)
+
+		try:
+			return await asyncio.wait_for(coro, timeout = timeout)
+		except asyncio.TimeoutError:
+			raise StageTimeoutError(description.rstrip('.'), timeout) from None
+
+
+class IngestPool():
+	"""
+	Runs ingestion jobs (resolving, validating and uploading submitted gifs) on a bounded pool of background workers
+
+	Submitting a job returns straight away with a future for its result, so that a slash command is
+	able to acknowledge the interaction first and then follow the job along, rather than doing all of
+	the network work within Discord's 3 second deadline. At most `workers` jobs run at once, and any
+	others wait their turn in order.
+
+	Args
+	----
+	- workers: Optional[int]
+		- The maximum amount of jobs run at once
+	- stage_timeout: Optional[float]
+		- The default amount of seconds a single stage of a job is able to take
+	- logger: Optional[Logger]
+		- The logger to report errors to
+	"""
+
+	def __init__(self, workers: Optional[int] = 4, stage_timeout: Optional[float] = 60.0, logger = None) -> None:
+		self.workers = workers
+		self.stage_timeout = stage_timeout
+		self.log = logger
+
+		self._queue: Optional[asyncio.Queue] = None
+		self._tasks: list = []
+
+	@property
+	def waiting(self) -> int:
+		"""
+		The amount of jobs waiting for a free worker
+		"""
+
+		return self._queue.qsize() if self._queue else 0
+
+	def start(self) -> None:
+		"""
+		Starts the workers on the current event loop
+		"""
+
+		if self._tasks:
+			return
+
+		self._queue = asyncio.Queue()
+		self._tasks = [asyncio.create_task(self._work(), name = f'ingest-{i}') for i in range(self.workers)]
+
+	def submit(self, pipeline, *args, progress = None, **kwargs) -> asyncio.Future:
+		"""
+		Queues a job, returning straight away
+
+		Args
+		----
+		- pipeline: Callable
+			- The coroutine function to run, which is given the job's `IngestJob` as its first argument
+		- *args, **kwargs
+			- The arguments to call the pipeline with
+		- progress: Optional[Callable]
+			- A coroutine function that's called with the description of each stage as it starts
+
+		Returns
+		----
+		- asyncio.Future
+			- A future for whatever the pipeline returns (or raises)
+		"""
+
+		if not self._tasks:
+			self.start()
+
+		future = asyncio.get_running_loop().create_future()
+		job = IngestJob(progress = progress, stage_timeout = self.stage_timeout, logger = self.log)
+		self._queue.put_nowait((job, pipeline, args, kwargs, future))
+		return future
+
+	async def _work(self) -> None:
+		while True:
+			job, pipeline, args, kwargs, future = await self._queue.get()
+
+			try:
+				# the submitter may have given up on the job while it was waiting
+				if future.done():
+					continue
+
+				result = await pipeline(job, *args, **kwargs)
+
+				if not future.done():
+					future.set_result(result)
+			except asyncio.CancelledError:
+				if not future.done():
+					future.cancel()
+
+				raise
+			except Exception as error:
+				if not future.done():
+					future.set_exception(error)
+			finally:
+				self._queue.task_done()
+
+	async def close(self) -> None:
+		"""
+		Stops every worker, cancelling any jobs still in progress or waiting
+		"""
+
+		for task in self._tasks:
+			task.cancel()
+
+		await asyncio.gather(*self._tasks, return_exceptions = True)
+		self._tasks = []
+
+		while self._queue and not self._queue.empty():
+			_, _, _, _, future = self._queue.get_nowait()
+			future.cancel()
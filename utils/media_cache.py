@@ -0,0 +1,329 @@
+import asyncio
+import json
+import os
+import secrets
+import shutil
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional, Union
+from utils.http import Download
+from utils.queue import normalize_url
+
+
+class MediaCache():
+	"""
+	Local, content-addressed cache of downloaded gifs
+
+	Every gif is stored once under the sha256 of its contents, and is looked up by its catbox URL,
+	so retrying a post, reposting a gif or prefetching one that's already been fetched never
+	downloads it again. Downloads land in a temporary file first, and are only moved into place
+	once they're complete, so a half-written gif is never handed out.
+
+	The cache is kept under `budget` bytes by evicting the least recently used gifs, skipping any
+	that are currently being posted. The catbox URL -> hash index is kept in `index.json`, so the
+	cache survives restarts. The index is written on a worker thread, so saving it never blocks the
+	event loop.
+
+	Args
+	----
+	- http: HttpManager
+		- The HTTP manager to download the gifs with
+	- directory: Union[str, os.PathLike, Path]
+		- The directory to store the gifs in
+	- budget: int
+		- The maximum amount of bytes the cache is able to take up
+	- size_limit: Optional[int]
+		- The maximum size of a single gif in bytes
+	- headers: Optional[dict]
+		- The headers to download the gifs with
+	- logger: Optional[Logger]
+		- The logger to report evictions to
+	"""
+
+	def __init__(
+		self,
+		http,
+		directory: Union[str, os.PathLike, Path],
+		budget: int,
+		size_limit: Optional[int] = None,
+		headers: Optional[dict] = None,
+		logger = None
+	) -> None:
+		self.http = http
+		self.directory = Path(directory)
+		self.index_path = self.directory / 'index.json'
+		self.incoming = self.directory / 'incoming'
+		self.budget = budget
+		self.size_limit = size_limit
+		self.headers = headers
+		self.log = logger
+
+		self._entries: OrderedDict = OrderedDict() # sha256 -> size, least recently used first
+		self._urls: dict = {} # normalized catbox url -> sha256
+		self._in_use: dict = {} # sha256 -> amount of holders
+		self._locks: dict = {} # normalized catbox url -> (lock, amount of fetches using it)
+		self._total = 0
+
+		# background index writes, and whether another one is needed once the current one finishes
+		self._saving: Optional[asyncio.Task] = None
+		self._dirty = False
+
+		self.load()
+
+	def load(self) -> None:
+		"""
+		Loads the index from disk, dropping anything that no longer has a file behind it
+		"""
+
+		if self.incoming.exists():
+			shutil.rmtree(self.incoming)
+
+		self.incoming.mkdir(parents = True, exist_ok = True)
+
+		index = {}
+		if self.index_path.exists():
+			try:
+				with open(self.index_path, 'r') as f:
+					index = json.load(f)
+			except (OSError, ValueError):
+				index = {}
+
+		# files the index doesn't know about (i.e from a crash before it was saved) are still usable, oldest first
+		files = sorted(self.directory.glob('*.gif'), key = lambda path: path.stat().st_mtime)
+		order = {sha256: i for i, sha256 in enumerate(index.get('order', []))}
+		files.sort(key = lambda path: order.get(path.stem, -1))
+
+		for path in files:
+			size = path.stat().st_size
+			self._entries[path.stem] = size
+			self._total += size
+
+		self._urls = {
+			url: sha256
+			for url, sha256 in index.get('urls', {}).items()
+			if sha256 in self._entries
+		}
+
+		self.evict()
+
+	def save_index(self) -> None:
+		"""
+		Saves the index to disk in the background
+
+		The write runs on a worker thread, and any saves requested while one is in progress are folded
+		into a single write afterwards. Outside of the event loop (i.e while loading), it's written straight away.
+		"""
+
+		self._dirty = True
+
+		try:
+			loop = asyncio.get_running_loop()
+		except RuntimeError:
+			self._dirty = False
+			self._write_index(self._snapshot())
+			return
+
+		if not self._saving or self._saving.done():
+			self._saving = loop.create_task(self._save_in_background(), name = 'media-cache-index')
+
+	async def _save_in_background(self) -> None:
+		while self._dirty:
+			self._dirty = False
+
+			try:
+				await asyncio.to_thread(self._write_index, self._snapshot())
+			except OSError as error:
+				if self.log:
+					self.log.error(f'Unable to save the media cache index: {error}')
+
+	def _snapshot(self) -> dict:
+		return {'urls': dict(self._urls), 'order': list(self._entries)}
+
+	def _write_index(self, index: dict) -> None:
+		# written to a temporary file first, so a crash mid-write never leaves a broken index behind
+		tmp_path = self.index_path.with_name(f'{self.index_path.name}.tmp')
+		with open(tmp_path, 'w') as f:
+			json.dump(index, f)
+			f.flush()
+			os.fsync(f.fileno())
+
+		os.replace(tmp_path, self.index_path)
+
+	async def flush(self) -> None:
+		"""
+		Waits for any pending index writes to finish
+		"""
+
+		if self._saving:
+			await self._saving
+
+	@property
+	def size(self) -> int:
+		"""
+		The amount of bytes the cache currently takes up
+		"""
+
+		return self._total
+
+	def path_for(self, sha256: str) -> Path:
+		return self.directory / f'{sha256}.gif'
+
+	def get(self, url: str) -> Optional[Download]:
+		"""
+		Returns the cached gif for the given catbox URL, or None if it isn't cached
+
+		Args
+		----
+		- url: str
+			- The catbox URL of the gif
+		"""
+
+		sha256 = self._urls.get(normalize_url(url))
+		if sha256 is None or sha256 not in self._entries:
+			return None
+
+		path = self.path_for(sha256)
+		if not path.exists():
+			self._drop(sha256)
+			self.save_index()
+			return None
+
+		self._entries.move_to_end(sha256)
+		return Download(status_code = 200, size = self._entries[sha256], sha256 = sha256, path = path)
+
+	async def fetch(self, url: str) -> Download:
+		"""
+		Returns the cached gif for the given catbox URL, downloading it if it isn't cached yet
+
+		Fetching the same URL more than once at a time only downloads it once.
+
+		Args
+		----
+		- url: str
+			- The catbox URL of the gif
+
+		Returns
+		----
+		- Download
+			- The cached gif, or the (non-ok) response if it couldn't be downloaded
+
+		Raises
+		----
+		- FileTooLargeError
+			- If the gif is larger than `size_limit`
+		"""
+
+		key = normalize_url(url)
+		lock, users = self._locks.get(key, (None, 0))
+		self._locks[key] = (lock := lock or asyncio.Lock(), users + 1)
+
+		try:
+			async with lock:
+				return await self._fetch(url, key)
+		finally:
+			# once nobody is fetching the URL anymore, its lock is dropped so they don't pile up
+			lock, users = self._locks[key]
+			if users == 1:
+				del self._locks[key]
+			else:
+				self._locks[key] = (lock, users - 1)
+
+	async def _fetch(self, url: str, key: str) -> Download:
+		cached = self.get(url)
+		if cached:
+			return cached
+
+		tmp_path = self.incoming / f'{secrets.token_hex(16)}.gif'
+		download = await self.http.download(url, dest = tmp_path, limit = self.size_limit, headers = self.headers)
+		if download.status_code != 200:
+			return download
+
+		# the same gif might already be cached under another URL
+		path = self.path_for(download.sha256)
+		if download.sha256 in self._entries and path.exists():
+			tmp_path.unlink(missing_ok = True)
+		else:
+			os.replace(tmp_path, path)
+			self._entries[download.sha256] = download.size
+			self._total += download.size
+
+		self._entries.move_to_end(download.sha256)
+		self._urls[key] = download.sha256
+
+		self.evict()
+		self.save_index()
+
+		return Download(status_code = 200, size = download.size, sha256 = download.sha256, path = path)
+
+	@contextmanager
+	def hold(self, sha256: str):
+		"""
+		Stops the given gif from being evicted for as long as it's held, i.e while it's being posted
+
+		Args
+		----
+		- sha256: str
+			- The hash of the gif
+		"""
+
+		self._in_use[sha256] = self._in_use.get(sha256, 0) + 1
+
+		try:
+			yield self.path_for(sha256)
+		finally:
+			self._in_use[sha256] -= 1
+			if not self._in_use[sha256]:
+				del self._in_use[sha256]
+
+			self.evict()
+
+	def evict(self) -> None:
+		"""
+		Removes the least recently used gifs until the cache is back under its budget
+		"""
+
+		evicted = False
+
+		for sha256 in list(self._entries):
+			if self._total <= self.budget:
+				break
+
+			if sha256 in self._in_use:
+				continue
+
+			if self.log:
+				self.log.info(f'Evicting {sha256} ({self._entries[sha256]} bytes) from the media cache')
+
+			self._drop(sha256)
+			evicted = True
+
+		if evicted:
+			self.save_index()
+
+	def discard(self, url: str) -> None:
+		"""
+		Forgets the given catbox URL, removing its gif unless another URL or a post in progress still needs it
+
+		Args
+		----
+		- url: str
+			- The catbox URL of the gif
+		"""
+
+		sha256 = self._urls.pop(normalize_url(url), None)
+		if sha256 is None:
+			return
+
+		if sha256 not in self._in_use and sha256 not in self._urls.values():
+			self._drop(sha256)
+
+		self.save_index()
+
+	def _drop(self, sha256: str) -> None:
+		size = self._entries.pop(sha256, None)
+		if size is not None:
+			self._total -= size
+
+		self.path_for(sha256).unlink(missing_ok = True)
+		self._urls = {url: value for url, value in self._urls.items() if value != sha256}
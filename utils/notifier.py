@@ -0,0 +1,117 @@
+import asyncio
+import traceback
+from typing import Optional
+import discord
+from utils.backoff import backoff_delay
+
+
+class WebhookNotifier():
+	"""
+	Delivers Discord webhook messages in the background, so that sending them never holds anything else up
+
+	Every webhook gets its own queue and worker. Messages to the same webhook are sent one at a
+	time and in order, which keeps each webhook within its own rate limit bucket (discord.py waits
+	out any 429s within a bucket itself), while different webhooks are sent to concurrently. A
+	message that fails to send is retried in the background with backoff, and is only given up on
+	after `max_attempts` tries.
+
+	Args
+	----
+	- http: HttpManager
+		- The HTTP manager whose long-lived aiohttp session the webhooks are sent through
+	- max_attempts: Optional[int]
+		- The maximum amount of times a single message is attempted
+	- logger: Optional[Logger]
+		- The logger to report failed messages to
+	"""
+
+	def __init__(self, http, max_attempts: Optional[int] = 5, logger = None) -> None:
+		self.http = http
+		self.max_attempts = max_attempts
+		self.log = logger
+
+		self._queues: dict = {}
+		self._workers: dict = {}
+
+	def send(self, webhook_url: str, **kwargs) -> None:
+		"""
+		Queues a message to be sent to a webhook, returning straight away
+
+		Args
+		----
+		- webhook_url: str
+			- The URL of the webhook
+		- **kwargs
+			- The arguments to send the message with, as taken by `discord.Webhook.send`
+		"""
+
+		if not webhook_url:
+			return
+
+		if webhook_url not in self._queues:
+			self._queues[webhook_url] = asyncio.Queue()
+
+		worker = self._workers.get(webhook_url)
+		if not worker or worker.done():
+			self._workers[webhook_url] = asyncio.create_task(self._work(webhook_url), name = 'webhook-notifier')
+
+		self._queues[webhook_url].put_nowait(kwargs)
+
+	async def _work(self, webhook_url: str) -> None:
+		queue = self._queues[webhook_url]
+
+		while True:
+			kwargs = await queue.get()
+
+			try:
+				await self._deliver(webhook_url, kwargs)
+			finally:
+				queue.task_done()
+
+	async def _deliver(self, webhook_url: str, kwargs: dict) -> None:
+		error = ''
+
+		for attempt in range(self.max_attempts):
+			try:
+				webhook = discord.Webhook.from_url(webhook_url, session = self.http.session)
+				await webhook.send(**kwargs)
+				return
+			except (discord.NotFound, discord.Forbidden, ValueError):
+				# the webhook was deleted or is invalid, so retrying won't help
+				error = traceback.format_exc()
+				break
+			except Exception:
+				error = traceback.format_exc()
+				if attempt == self.max_attempts - 1:
+					break
+
+				delay = backoff_delay(attempt, initial = 2.0, maximum = 120.0)
+				if self.log:
+					self.log.warning(f"Unable to send a webhook message, retrying in {delay:.1f} seconds...")
+
+				await asyncio.sleep(delay)
+
+		if self.log:
+			self.log.error(f"Giving up on sending a webhook message\n{error}")
+
+	async def close(self, timeout: Optional[float] = 10.0) -> None:
+		"""
+		Gives any queued messages a chance to be sent, then stops every worker
+
+		Args
+		----
+		- timeout: Optional[float]
+			- The maximum amount of seconds to wait for the queued messages
+		"""
+
+		try:
+			await asyncio.wait_for(asyncio.gather(*[queue.join() for queue in self._queues.values()]), timeout = timeout)
+		except asyncio.TimeoutError:
+			if self.log:
+				self.log.warning("Timed out while sending the remaining webhook messages")
+
+		for worker in self._workers.values():
+			worker.cancel()
+
+		await asyncio.gather(*self._workers.values(), return_exceptions = True)
+		self._workers.clear()
@@ -0,0 +1,84 @@
+import base64
+import hashlib
+import hmac
+import secrets
+import time
+from typing import Optional
+from urllib.parse import parse_qsl, quote, urlsplit, urlunsplit
+
+
+def percent_encode(value) -> str:
+	"""
+	Percent-encodes a value as per RFC 3986, which OAuth 1.0a signatures require
+	"""
+
+	return quote(str(value), safe = '')
+
+
+class OAuth1Signer():
+	"""
+	Signs requests with OAuth 1.0a (HMAC-SHA1), for APIs that still require it (Tumblr and Twitter's v1.1 API)
+
+	A signer is created once per set of credentials and reused for every request, rather than
+	constructing a new client each time. Only query parameters and form-encoded bodies are part of
+	the signature, so multipart and JSON bodies are able to be sent as-is.
+
+	Args
+	----
+	- consumer_key: str
+		- The consumer key of the application
+	- consumer_secret: str
+		- The consumer secret of the application
+	- token: str
+		- The OAuth token of the user
+	- token_secret: str
+		- The OAuth token secret of the user
+	"""
+
+	def __init__(self, consumer_key: str, consumer_secret: str, token: str, token_secret: str) -> None:
+		self.consumer_key = consumer_key
+		self.token = token
+		self._signing_key = f'{percent_encode(consumer_secret)}&{percent_encode(token_secret)}'.encode()
+
+	def authorization(self, method: str, url: str, params: Optional[dict] = None) -> str:
+		"""
+		Returns the Authorization header for a request
+
+		Args
+		----
+		- method: str
+			- The HTTP method of the request
+		- url: str
+			- The URL of the request, including any query parameters
+		- params: Optional[dict]
+			- Any form-encoded body parameters of the request
+
+		Returns
+		----
+		- str
+			- The value of the Authorization header
+		"""
+
+		oauth_params = {
+			'oauth_consumer_key': self.consumer_key,
+			'oauth_nonce': secrets.token_hex(16),
+			'oauth_signature_method': 'HMAC-SHA1',
+			'oauth_timestamp': str(int(time.time())),
+			'oauth_token': self.token,
+			'oauth_version': '1.0',
+		}
+
+		scheme, netloc, path, query, _ = urlsplit(url)
+		base_url = urlunsplit((scheme.lower(), netloc.lower(), path, '', ''))
+
+		pairs = [*oauth_params.items(), *parse_qsl(query, keep_blank_values = True), *(params or {}).items()]
+		param_str = '&'.join(
+			f'{key}={value}'
+			for key, value in sorted((percent_encode(key), percent_encode(value)) for key, value in pairs)
+		)
+
+		base_str = '&'.join((method.upper(), percent_encode(base_url), percent_encode(param_str)))
+		signature = base64.b64encode(hmac.new(self._signing_key, base_str.encode(), hashlib.sha1).digest()).decode()
+		oauth_params['oauth_signature'] = signature
+
+		return 'OAuth ' + ', '.join(f'{percent_encode(key)}="{percent_encode(value)}"' for key, value in sorted(oauth_params.items()))
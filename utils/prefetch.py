@@ -0,0 +1,146 @@
+import asyncio
+import traceback
+from typing import Optional
+from utils.http import FileTooLargeError
+
+
+class Prefetcher():
+	"""
+	Downloads the next few gifs in the queue ahead of time, so they're already on disk when their post goes out
+
+	Gifs are fetched into the media cache, which the post loop reads from, so a prefetched gif is
+	never downloaded a second time. Removing a post drops its gif from the cache (unless something
+	else still needs it), and any change to the queue wakes the prefetcher up so that it's able to
+	fetch whatever is now next in line.
+
+	Args
+	----
+	- queue: QueueService
+		- The queue to fetch the upcoming posts from
+	- cache: MediaCache
+		- The media cache to fetch the gifs into
+	- depth: Optional[int]
+		- The amount of posts at the head of the queue to keep fetched
+	- interval: Optional[float]
+		- The amount of seconds between checks, if nothing wakes the prefetcher up sooner
+	- logger: Optional[Logger]
+		- The logger to report downloads and errors to
+	"""
+
+	def __init__(
+		self,
+		queue,
+		cache,
+		depth: Optional[int] = 2,
+		interval: Optional[float] = 600.0,
+		logger = None
+	) -> None:
+		self.queue = queue
+		self.cache = cache
+		self.depth = depth
+		self.interval = interval
+		self.log = logger
+
+		# post id -> catbox url, for every post whose gif has been prefetched
+		self._prefetched: dict = {}
+		self._wake = asyncio.Event()
+		self._task: Optional[asyncio.Task] = None
+
+		queue.add_listener(self._on_queue_change)
+
+	def start(self) -> None:
+		"""
+		Starts prefetching in the background
+		"""
+
+		if not self._task or self._task.done():
+			self._task = asyncio.create_task(self._run(), name = 'prefetch')
+
+	async def stop(self) -> None:
+		"""
+		Stops prefetching, and waits for any download in progress to be cancelled
+		"""
+
+		if not self._task or self._task.done():
+			return
+
+		self._task.cancel()
+
+		try:
+			await self._task
+		except asyncio.CancelledError:
+			pass
+
+	def wake(self) -> None:
+		"""
+		Makes the prefetcher check the queue again right away
+		"""
+
+		self._wake.set()
+
+	def _on_queue_change(self, event: str, post_id: int) -> None:
+		# edits are only able to change the caption and alt text, so the gif itself is still valid
+		# posted gifs are kept around in the cache, in case the post needs to be retried
+		catbox_url = self._prefetched.pop(post_id, None) if event in ('remove', 'pop') else None
+		if event == 'remove' and catbox_url:
+			self.cache.discard(catbox_url)
+
+		self.wake()
+
+	async def _run(self) -> None:
+		while True:
+			try:
+				await self.refresh()
+			except asyncio.CancelledError:
+				raise
+			except Exception:
+				if self.log:
+					self.log.error(f"An error occurred while prefetching\n{traceback.format_exc()}")
+
+			try:
+				await asyncio.wait_for(self._wake.wait(), timeout = self.interval)
+			except asyncio.TimeoutError:
+				pass
+
+			self._wake.clear()
+
+	async def refresh(self) -> None:
+		"""
+		Fetches the gifs of the posts at the head of the queue into the media cache
+		"""
+
+		for post in self.queue.peek(self.depth):
+			if self.cache.get(post['catbox_url']):
+				self._prefetched[post['id']] = post['catbox_url']
+				continue
+
+			try:
+				download = await self.cache.fetch(post['catbox_url'])
+			except FileTooLargeError:
+				if self.log:
+					self.log.warning(f"Not prefetching {post['catbox_url']}, as it's over the size limit")
+
+				continue
+			except asyncio.CancelledError:
+				raise
+			except Exception:
+				if self.log:
+					self.log.warning(f"Unable to prefetch {post['catbox_url']}\n{traceback.format_exc()}")
+
+				continue
+
+			if download.status_code != 200:
+				if self.log:
+					self.log.warning(f"Unable to prefetch {post['catbox_url']} (status code {download.status_code})")
+
+				continue
+
+			# the post might've been removed while it was downloading
+			if post['id'] not in self.queue.store:
+				self.cache.discard(post['catbox_url'])
+				continue
+
+			self._prefetched[post['id']] = post['catbox_url']
+
+			if self.log:
+				self.log.info(f"Prefetched {post['catbox_url']} ({download.size} bytes)")
@@ -0,0 +1,790 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Union
+from urllib.parse import urlsplit, urlunsplit
+
+# Columns of a post that are able to be edited after it has been queued
+EDITABLE_FIELDS = ('caption', 'alt_text')
+
+# Columns of a delivery (the state of a post on a single platform)
+DELIVERY_FIELDS = ('post_id', 'platform', 'state', 'media_id', 'status_id', 'url', 'attempts', 'deferrals', 'error', 'updated_at')
+
+
+class QueueStore():
+	"""
+	SQLite backed post queue
+
+	Posts are ordered by their ID, which is assigned when they're queued and never changes afterwards.
+	Every operation is a single indexed lookup, so the cost of queueing, posting, editing or deleting
+	a post stays the same no matter how large the queue gets.
+
+	Each post also carries a version, which is bumped on every edit. Edits and removals are able to
+	pass the version they last saw, and will only go through if the post hasn't changed since.
+
+	Every queued post is also kept in memory, alongside a hash index of its normalized original and
+	catbox URLs, so that lookups by ID or URL (i.e duplicate checks) never have to touch the database.
+	The index is loaded when the store is opened, and updated after every committed mutation.
+
+	Writes go through one connection, guarded by a lock that's held for the whole transaction. Reads
+	that do need the database (ordering, positions and deliveries) go through a second, read-only
+	connection with its own lock, so with WAL mode they're never left waiting on a write to commit.
+
+	Alongside each post, the store keeps a delivery record per platform (see `Delivery`), so that a
+	post which only partially went out is able to be retried on just the platforms it's missing from,
+	even after a restart. A post's deliveries are removed along with it.
+
+	A post that still has platforms to retry is parked in a separate retry set rather than being kept
+	at the head, so the queue is able to move on while its outstanding deliveries are retried alongside
+	the posts after it. Parked posts keep their deliveries until they're finished with, and stay in
+	the URL index (so the same gif isn't able to be queued again while it's being retried), and are
+	still able to be removed.
+
+	Args
+	----
+	- path: Union[str, os.PathLike, Path]
+		- The path to the database file
+	"""
+
+	def __init__(self, path: Union[str, os.PathLike, Path]) -> None:
+		self.db_path: Path = Path(path)
+
+		# the connection is shared between the event loop and the threads writes run on, so we guard it ourselves
+		self._lock = threading.RLock()
+		self.conn = sqlite3.connect(self.db_path, check_same_thread = False)
+		self.conn.row_factory = sqlite3.Row
+
+		# in-memory copies of every queued post, and their normalized urls
+		self._posts: dict = {}
+		self._url_index: dict = {}
+
+		# posts that have been parked to retry their outstanding deliveries, keyed by ID
+		self._retries: dict = {}
+
+		with self._lock:
+			self.conn.execute('PRAGMA journal_mode = WAL')
+			self.conn.execute('PRAGMA synchronous = NORMAL')
+			self.create_tables()
+			self.load_index()
+
+		# reads get their own connection (and lock), so they never queue up behind a write transaction
+		self._read_lock = threading.Lock()
+		self.reader = sqlite3.connect(f'{self.db_path.resolve().as_uri()}?mode=ro', uri = True, check_same_thread = False)
+		self.reader.row_factory = sqlite3.Row
+
+	def create_tables(self) -> None:
+		"""
+		Creates the queue table and its indexes if they don't already exist
+		"""
+
+		with self._lock, self.conn:
+			self.conn.execute("""
+				CREATE TABLE IF NOT EXISTS posts (
+					id INTEGER PRIMARY KEY AUTOINCREMENT,
+					original_url TEXT NOT NULL,
+					catbox_url TEXT NOT NULL,
+					author TEXT NOT NULL DEFAULT '',
+					emoji TEXT NOT NULL DEFAULT '',
+					caption TEXT NOT NULL DEFAULT '',
+					alt_text TEXT NOT NULL DEFAULT '',
+					created_at INTEGER NOT NULL,
+					version INTEGER NOT NULL DEFAULT 1
+				)
+			""")
+
+			# databases created before posts were versioned won't have the column yet
+			columns = [row['name'] for row in self.conn.execute('PRAGMA table_info(posts)')]
+			if 'version' not in columns:
+				self.conn.execute('ALTER TABLE posts ADD COLUMN version INTEGER NOT NULL DEFAULT 1')
+
+			self.conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS posts_original_url ON posts (original_url)')
+			self.conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS posts_catbox_url ON posts (catbox_url)')
+
+			self.conn.execute("""
+				CREATE TABLE IF NOT EXISTS deliveries (
+					post_id INTEGER NOT NULL,
+					platform TEXT NOT NULL,
+					state TEXT NOT NULL DEFAULT 'pending',
+					media_id TEXT,
+					status_id TEXT,
+					url TEXT,
+					attempts INTEGER NOT NULL DEFAULT 0,
+					deferrals INTEGER NOT NULL DEFAULT 0,
+					error TEXT,
+					updated_at INTEGER NOT NULL,
+					PRIMARY KEY (post_id, platform)
+				)
+			""")
+
+			# databases created before deferrals were counted won't have the column yet
+			columns = [row['name'] for row in self.conn.execute('PRAGMA table_info(deliveries)')]
+			if 'deferrals' not in columns:
+				self.conn.execute('ALTER TABLE deliveries ADD COLUMN deferrals INTEGER NOT NULL DEFAULT 0')
+
+			self.conn.execute("""
+				CREATE TABLE IF NOT EXISTS retries (
+					post_id INTEGER PRIMARY KEY,
+					post TEXT NOT NULL,
+					parked_at INTEGER NOT NULL
+				)
+			""")
+
+	def load_index(self) -> None:
+		"""
+		Loads every queued post into memory and rebuilds the URL index
+		"""
+
+		with self._lock:
+			self._posts.clear()
+			self._url_index.clear()
+
+			for row in self.conn.execute('SELECT * FROM posts ORDER BY id'):
+				self._index_post(dict(row))
+
+			self._retries.clear()
+			for row in self.conn.execute('SELECT post FROM retries ORDER BY post_id'):
+				post = json.loads(row['post'])
+				self._retries[post['id']] = post
+				self._index_urls(post)
+
+	def _index_post(self, post: dict) -> None:
+		self._posts[post['id']] = post
+		self._index_urls(post)
+
+	def _index_urls(self, post: dict) -> None:
+		self._url_index[normalize_url(post['original_url'])] = post['id']
+		self._url_index[normalize_url(post['catbox_url'])] = post['id']
+
+	def _unindex_post(self, post_id: int) -> None:
+		self._unindex_urls(self._posts.pop(post_id, None))
+
+	def _unindex_urls(self, post: Optional[dict]) -> None:
+		if not post:
+			return
+
+		post_id = post['id']
+		for url in (post['original_url'], post['catbox_url']):
+			key = normalize_url(url)
+			if self._url_index.get(key) == post_id:
+				del self._url_index[key]
+
+	def __len__(self) -> int:
+		return len(self._posts)
+
+	def __contains__(self, post_id: int) -> bool:
+		return post_id in self._posts
+
+	def all(self) -> list:
+		"""
+		Returns every post in the queue, in the order they will be posted
+		"""
+
+		with self._read_lock:
+			rows = self.reader.execute('SELECT * FROM posts ORDER BY id').fetchall()
+
+		return [dict(row) for row in rows]
+
+	def head(self) -> Optional[dict]:
+		"""
+		Returns the next post to be posted, or None if the queue is empty
+		"""
+
+		with self._read_lock:
+			row = self.reader.execute('SELECT * FROM posts ORDER BY id LIMIT 1').fetchone()
+
+		return dict(row) if row else None
+
+	def peek(self, limit: int) -> list:
+		"""
+		Returns the next few posts to be posted, in the order they will be posted
+
+		Args
+		----
+		- limit: int
+			- The maximum amount of posts to return
+		"""
+
+		with self._read_lock:
+			rows = self.reader.execute('SELECT * FROM posts ORDER BY id LIMIT ?', (limit,)).fetchall()
+
+		return [dict(row) for row in rows]
+
+	def get(self, post_id: int) -> Optional[dict]:
+		"""
+		Returns the post with the given ID, or None if it isn't in the queue
+
+		Args
+		----
+		- post_id: int
+			- The ID of the post
+		"""
+
+		post = self._posts.get(post_id)
+		return dict(post) if post else None
+
+	def find_by_url(self, url: str) -> Optional[dict]:
+		"""
+		Returns the post with the given original or catbox URL, or None if it isn't in the queue (or being retried)
+
+		Args
+		----
+		- url: str
+			- The original or catbox URL of the post
+		"""
+
+		post_id = self._url_index.get(normalize_url(url))
+		post = self._posts.get(post_id) or self._retries.get(post_id)
+		return dict(post) if post else None
+
+	def position(self, post_id: int) -> int:
+		"""
+		Returns the zero-based position of the given post within the queue
+
+		Args
+		----
+		- post_id: int
+			- The ID of the post
+		"""
+
+		with self._read_lock:
+			return self.reader.execute('SELECT COUNT(*) FROM posts WHERE id < ?', (post_id,)).fetchone()[0]
+
+	def enqueue(self, post: dict) -> Optional[dict]:
+		"""
+		Adds a post to the end of the queue
+
+		Args
+		----
+		- post: dict
+			- The post to add
+
+		Returns
+		----
+		- Optional[dict]
+			- The queued post (including its ID), or None if its URL is already in the queue
+		"""
+
+		queued = self.enqueue_many([post])
+		return queued[0] if queued else None
+
+	def enqueue_many(self, posts: list) -> list:
+		"""
+		Adds multiple posts to the end of the queue within a single transaction
+
+		Args
+		----
+		- posts: list
+			- The posts to add, in order
+
+		Returns
+		----
+		- list
+			- The posts that were queued (including their IDs), skipping any whose URL is already in the queue
+		"""
+
+		queued = []
+		seen_urls = set()
+
+		with self._lock:
+			with self.conn:
+				for post in posts:
+					urls = {normalize_url(post['original_url']), normalize_url(post['catbox_url'])}
+
+					# skip anything already queued, including urls that only differ in formatting
+					if any(url in self._url_index or url in seen_urls for url in urls):
+						continue
+
+					cursor = self.conn.execute(
+						"""
+						INSERT OR IGNORE INTO posts (original_url, catbox_url, author, emoji, caption, alt_text, created_at)
+						VALUES (?, ?, ?, ?, ?, ?, ?)
+						""",
+						(
+							post['original_url'],
+							post['catbox_url'],
+							post.get('author', ''),
+							post.get('emoji', ''),
+							post.get('caption', '') or '',
+							post.get('alt_text', ''),
+							int(time.time()),
+						)
+					)
+
+					if cursor.rowcount > 0:
+						seen_urls.update(urls)
+						queued.append(cursor.lastrowid)
+
+				rows = [self.conn.execute('SELECT * FROM posts WHERE id = ?', (post_id,)).fetchone() for post_id in queued]
+
+			# only index the posts once they've been committed
+			for row in rows:
+				self._index_post(dict(row))
+
+			return [self.get(row['id']) for row in rows]
+
+	def dequeue(self, post_id: Optional[int] = None) -> Optional[dict]:
+		"""
+		Removes and returns the post at the head of the queue
+
+		Args
+		----
+		- post_id: Optional[int]
+			- If given, the head is only removed if it's still this post
+
+		Returns
+		----
+		- Optional[dict]
+			- The removed post, or None if nothing was removed
+		"""
+
+		with self._lock:
+			row = self.conn.execute('SELECT * FROM posts ORDER BY id LIMIT 1').fetchone()
+			post = dict(row) if row else None
+			if not post or (post_id is not None and post['id'] != post_id):
+				return None
+
+			with self.conn:
+				self.conn.execute('DELETE FROM posts WHERE id = ?', (post['id'],))
+				self.conn.execute('DELETE FROM deliveries WHERE post_id = ?', (post['id'],))
+
+			self._unindex_post(post['id'])
+			return post
+
+	def park(self, post_id: int) -> Optional[dict]:
+		"""
+		Moves the post at the head of the queue into the retry set, keeping its deliveries
+
+		Args
+		----
+		- post_id: int
+			- The ID of the post, which is only parked if it's still at the head
+
+		Returns
+		----
+		- Optional[dict]
+			- The parked post, or None if nothing was parked
+		"""
+
+		with self._lock:
+			row = self.conn.execute('SELECT * FROM posts ORDER BY id LIMIT 1').fetchone()
+			post = dict(row) if row else None
+			if not post or post['id'] != post_id:
+				return None
+
+			with self.conn:
+				self.conn.execute('INSERT OR REPLACE INTO retries (post_id, post, parked_at) VALUES (?, ?, ?)', (post_id, json.dumps(post), int(time.time())))
+				self.conn.execute('DELETE FROM posts WHERE id = ?', (post_id,))
+
+			# its urls stay indexed, so the gif isn't able to be queued again while it's being retried
+			self._posts.pop(post_id, None)
+			self._retries[post_id] = post
+			return post
+
+	def retries(self) -> list:
+		"""
+		Returns every parked post, in the order they were queued, each marked with `retrying`
+		"""
+
+		with self._read_lock:
+			rows = self.reader.execute('SELECT post FROM retries ORDER BY post_id').fetchall()
+
+		return [{**json.loads(row['post']), 'retrying': True} for row in rows]
+
+	def finish_retry(self, post_id: int, expected_version: Optional[int] = None) -> bool:
+		"""
+		Removes a parked post from the retry set, along with its deliveries
+
+		Args
+		----
+		- post_id: int
+			- The ID of the post
+		- expected_version: Optional[int]
+			- If given, the post is only removed if its version still matches
+
+		Returns
+		----
+		- bool
+			- Whether or not the post was parked (and removed)
+		"""
+
+		with self._lock:
+			post = self._retries.get(post_id)
+			if not post or (expected_version is not None and post['version'] != expected_version):
+				return False
+
+			with self.conn:
+				self.conn.execute('DELETE FROM retries WHERE post_id = ?', (post_id,))
+				self.conn.execute('DELETE FROM deliveries WHERE post_id = ?', (post_id,))
+
+			self._unindex_urls(self._retries.pop(post_id))
+			return True
+
+	def edit(self, post_id: int, changes: dict, expected_version: Optional[int] = None) -> Optional[dict]:
+		"""
+		Edits a post within the queue
+
+		Args
+		----
+		- post_id: int
+			- The ID of the post to edit
+		- changes: dict
+			- The fields to change, only `caption` and `alt_text` are able to be edited
+		- expected_version: Optional[int]
+			- If given, the post is only edited if its version still matches
+
+		Returns
+		----
+		- Optional[dict]
+			- The edited post, or None if it wasn't found or has changed since
+		"""
+
+		fields = [field for field in EDITABLE_FIELDS if field in changes]
+		if not fields or post_id not in self._posts:
+			return None
+
+		query = f"UPDATE posts SET {', '.join(f'{field} = ?' for field in fields)}, version = version + 1 WHERE id = ?"
+		params = [changes[field] or '' for field in fields] + [post_id]
+
+		if expected_version is not None:
+			query += ' AND version = ?'
+			params.append(expected_version)
+
+		with self._lock:
+			with self.conn:
+				cursor = self.conn.execute(query, params)
+				row = self.conn.execute('SELECT * FROM posts WHERE id = ?', (post_id,)).fetchone() if cursor.rowcount > 0 else None
+
+			if not row:
+				return None
+
+			self._index_post(dict(row))
+			return self.get(post_id)
+
+	def remove(self, post_id: int, expected_version: Optional[int] = None) -> bool:
+		"""
+		Removes a post from the queue
+
+		Args
+		----
+		- post_id: int
+			- The ID of the post to remove
+		- expected_version: Optional[int]
+			- If given, the post is only removed if its version still matches
+
+		Returns
+		----
+		- bool
+			- Whether or not the post was found and removed
+		"""
+
+		# parked posts are removed from the retry set instead
+		if post_id in self._retries:
+			return self.finish_retry(post_id, expected_version)
+
+		# nothing to do if the index doesn't know about the post
+		if post_id not in self._posts:
+			return False
+
+		query = 'DELETE FROM posts WHERE id = ?'
+		params = [post_id]
+
+		if expected_version is not None:
+			query += ' AND version = ?'
+			params.append(expected_version)
+
+		with self._lock:
+			with self.conn:
+				cursor = self.conn.execute(query, params)
+				if cursor.rowcount:
+					self.conn.execute('DELETE FROM deliveries WHERE post_id = ?', (post_id,))
+
+			if cursor.rowcount == 0:
+				return False
+
+			self._unindex_post(post_id)
+			return True
+
+	def remove_by_url(self, url: str) -> bool:
+		"""
+		Removes a post from the queue by its original or catbox URL
+
+		Args
+		----
+		- url: str
+			- The original or catbox URL of the post
+
+		Returns
+		----
+		- bool
+			- Whether or not the post was found and removed
+		"""
+
+		post_id = self._url_index.get(normalize_url(url))
+		if post_id is None:
+			return False
+
+		return self.remove(post_id)
+
+	def deliveries(self, post_id: int) -> dict:
+		"""
+		Returns the delivery records of the given post
+
+		Args
+		----
+		- post_id: int
+			- The ID of the post
+
+		Returns
+		----
+		- dict
+			- Delivery records keyed by platform, i.e `{'twitter': {'state': 'posted', ...}}`
+		"""
+
+		with self._read_lock:
+			rows = self.reader.execute('SELECT * FROM deliveries WHERE post_id = ?', (post_id,)).fetchall()
+
+		return {row['platform']: dict(row) for row in rows}
+
+	def save_delivery(self, record: dict) -> bool:
+		"""
+		Saves the delivery record of a post on a single platform
+
+		Args
+		----
+		- record: dict
+			- The delivery record, containing every field in DELIVERY_FIELDS other than `updated_at`
+
+		Returns
+		----
+		- bool
+			- Whether or not the record was saved (it isn't if the post has since left the queue and the retry set)
+		"""
+
+		record = {**record, 'updated_at': int(time.time())}
+
+		with self._lock:
+			if record['post_id'] not in self._posts and record['post_id'] not in self._retries:
+				return False
+
+			with self.conn:
+				self.conn.execute(
+					f'INSERT OR REPLACE INTO deliveries ({", ".join(DELIVERY_FIELDS)}) VALUES ({", ".join("?" * len(DELIVERY_FIELDS))})',
+					[record.get(field) for field in DELIVERY_FIELDS]
+				)
+
+			return True
+
+	def migrate_from_config(self, config) -> int:
+		"""
+		Moves any posts still stored under the `queue` key of the config file into the database
+
+		This only does anything the first time the bot starts after upgrading, as the key is removed afterwards.
+
+		Args
+		----
+		- config: Config
+			- The config to migrate from
+
+		Returns
+		----
+		- int
+			- The amount of posts that were migrated
+		"""
+
+		legacy_queue = config.get('queue')
+		if legacy_queue is None:
+			return 0
+
+		migrated = self.enqueue_many(legacy_queue)
+
+		config.delete('queue')
+		config.flush()
+		return len(migrated)
+
+
+def normalize_url(url: str) -> str:
+	"""
+	Normalizes a URL for use as an index key, so that the same gif is always found no matter how its URL was formatted
+
+	The scheme and host are lowercased, and the fragment and any trailing slash are dropped.
+	Query parameters are kept, as some hosts need them to serve the file.
+
+	Args
+	----
+	- url: str
+		- The URL to normalize
+	"""
+
+	parts = urlsplit(url.strip())
+	return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip('/'), parts.query, ''))
+
+
+class QueueService():
+	"""
+	Async interface to the post queue, which every command and the post loop go through
+
+	Reads go straight to the store, either from its in-memory index or through its read-only connection,
+	so they run alongside a write (WAL mode) rather than waiting on it. Writes are serialized through a lock, and run on a worker thread so that committing to disk never
+	blocks the event loop. Every write is a single transaction, and edits/removals are able to be made
+	conditional on the version of the post the caller last saw, so concurrent changes are never lost.
+
+	Anything that needs to know when the queue changes (i.e the prefetcher) is able to register a
+	listener, which is called with the kind of change (`enqueue`, `edit`, `remove` or `pop`) and
+	the ID of the post it affected once the change has been committed. A post being parked to retry
+	its deliveries leaves the queue, so it counts as a `pop`.
+
+	Args
+	----
+	- store: QueueStore
+		- The store to read from and write to
+	"""
+
+	def __init__(self, store: QueueStore) -> None:
+		self.store = store
+		self._lock = asyncio.Lock()
+		self._listeners: list = []
+
+	async def _write(self, func, *args):
+		async with self._lock:
+			return await asyncio.to_thread(func, *args)
+
+	def add_listener(self, listener) -> None:
+		"""
+		Registers a function to be called whenever the queue changes
+
+		Args
+		----
+		- listener: Callable
+			- A function taking the kind of change, and the ID of the post it affected
+		"""
+
+		self._listeners.append(listener)
+
+	def _notify(self, event: str, post_id: int) -> None:
+		for listener in self._listeners:
+			listener(event, post_id)
+
+	# ---- Reads ---- #
+	def __len__(self) -> int:
+		return len(self.store)
+
+	def all(self) -> list:
+		return self.store.all()
+
+	def head(self) -> Optional[dict]:
+		return self.store.head()
+
+	def peek(self, limit: int) -> list:
+		return self.store.peek(limit)
+
+	def get(self, post_id: int) -> Optional[dict]:
+		return self.store.get(post_id)
+
+	def find_by_url(self, url: str) -> Optional[dict]:
+		return self.store.find_by_url(url)
+
+	def position(self, post_id: int) -> int:
+		return self.store.position(post_id)
+
+	def deliveries(self, post_id: int) -> dict:
+		return self.store.deliveries(post_id)
+
+	def retries(self) -> list:
+		return self.store.retries()
+
+	# ---- Writes ---- #
+	async def enqueue(self, post: dict) -> Optional[dict]:
+		"""
+		Adds a post to the end of the queue, returning None if its URL is already queued
+		"""
+
+		queued = await self._write(self.store.enqueue, post)
+		if queued:
+			self._notify('enqueue', queued['id'])
+
+		return queued
+
+	async def enqueue_many(self, posts: list) -> list:
+		"""
+		Adds multiple posts to the end of the queue in a single transaction, returning the ones that were queued
+		"""
+
+		queued = await self._write(self.store.enqueue_many, posts)
+		for post in queued:
+			self._notify('enqueue', post['id'])
+
+		return queued
+
+	async def pop_head(self, post_id: int) -> Optional[dict]:
+		"""
+		Removes the post at the head of the queue, but only if it's still the given post
+		"""
+
+		popped = await self._write(self.store.dequeue, post_id)
+		if popped:
+			self._notify('pop', popped['id'])
+
+		return popped
+
+	async def park_head(self, post_id: int) -> Optional[dict]:
+		"""
+		Moves the post at the head of the queue into the retry set, but only if it's still the given post
+		"""
+
+		parked = await self._write(self.store.park, post_id)
+		if parked:
+			self._notify('pop', parked['id'])
+
+		return parked
+
+	async def finish_retry(self, post_id: int) -> bool:
+		"""
+		Removes a post from the retry set once it's fully gone out (or been given up on)
+		"""
+
+		return await self._write(self.store.finish_retry, post_id)
+
+	async def update(self, post_id: int, changes: dict, expected_version: Optional[int] = None) -> Optional[dict]:
+		"""
+		Edits a post, returning the edited post or None if it's gone or was changed by someone else
+		"""
+
+		edited = await self._write(self.store.edit, post_id, changes, expected_version)
+		if edited:
+			self._notify('edit', post_id)
+
+		return edited
+
+	async def remove(self, post_id: int, expected_version: Optional[int] = None) -> bool:
+		"""
+		Removes a post, returning whether or not it was removed
+		"""
+
+		removed = await self._write(self.store.remove, post_id, expected_version)
+		if removed:
+			self._notify('remove', post_id)
+
+		return removed
+
+	async def remove_by_url(self, url: str) -> bool:
+		"""
+		Removes a post by its original or catbox URL, returning whether or not it was removed
+		"""
+
+		post = self.store.find_by_url(url)
+		removed = await self._write(self.store.remove_by_url, url)
+		if removed and post:
+			self._notify('remove', post['id'])
+
+		return removed
+
+	async def save_delivery(self, record: dict) -> bool:
+		"""
+		Saves the delivery record of a post on a single platform, returning False if the post has left the queue
+		"""
+
+		return await self._write(self.store.save_delivery, record)
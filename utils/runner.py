@@ -0,0 +1,92 @@
+import asyncio
+import traceback
+from typing import Optional
+
+
+class JobRunner():
+	"""
+	Runs a job as a supervised background task on the current event loop
+
+	Only one run of the job is able to be in progress at a time, so a slow run is never able to
+	overlap with the next one. Each run is given a timeout, and any errors it raises are logged
+	rather than taking down whatever started it.
+
+	Args
+	----
+	- name: str
+		- The name of the job, used for logging
+	- timeout: Optional[float]
+		- The maximum amount of seconds a single run is able to take
+	- logger: Optional[Logger]
+		- The logger to report errors to
+	"""
+
+	def __init__(self, name: str, timeout: Optional[float] = None, logger = None) -> None:
+		self.name = name
+		self.timeout = timeout
+		self.log = logger
+		self._task: Optional[asyncio.Task] = None
+
+	@property
+	def running(self) -> bool:
+		"""
+		Whether or not a run of the job is currently in progress
+		"""
+
+		return self._task is not None and not self._task.done()
+
+	def submit(self, func, *args, **kwargs) -> bool:
+		"""
+		Starts a run of the job in the background, unless one is already in progress
+
+		Args
+		----
+		- func: Callable
+			- The coroutine function to run
+		- *args, **kwargs
+			- The arguments to call the function with
+
+		Returns
+		----
+		- bool
+			- Whether or not the run was started
+		"""
+
+		if self.running:
+			if self.log:
+				self.log.warning(f"The previous {self.name} job is still running. Skipping...")
+
+			return False
+
+		self._task = asyncio.create_task(self._supervise(func, *args, **kwargs), name = f'{self.name}-job')
+		return True
+
+	async def _supervise(self, func, *args, **kwargs) -> None:
+		try:
+			await asyncio.wait_for(func(*args, **kwargs), timeout = self.timeout)
+		except asyncio.TimeoutError:
+			if self.log:
+				self.log.error(f"The {self.name} job timed out after {self.timeout} seconds")
+		except asyncio.CancelledError:
+			if self.log:
+				self.log.warning(f"The {self.name} job was cancelled")
+
+			raise
+		except Exception:
+			if self.log:
+				self.log.error(f"An error occurred while running the {self.name} job\n{traceback.format_exc()}")
+
+	async def cancel(self) -> None:
+		"""
+		Cancels the run in progress (if any), and waits for it to stop
+		"""
+
+		if not self.running:
+			return
+
+		self._task.cancel()
+
+		try:
+			await self._task
+		except asyncio.CancelledError:
+			pass
@@ -0,0 +1,310 @@
+import asyncio
+import time
+import traceback
+from datetime import datetime
+from typing import Optional
+from utils.backoff import backoff_delay
+
+
+class RateLimitedError(Exception):
+	"""
+	Raised by a publisher when a platform tells it to slow down
+
+	Args
+	----
+	- platform: str
+		- The platform that rate limited the request
+	- reset_at: Optional[float]
+		- When the rate limit resets, as a unix timestamp (if the platform said)
+	"""
+
+	def __init__(self, platform: str, reset_at: Optional[float] = None) -> None:
+		super().__init__(f'{platform} is rate limited' + (f' until {datetime.fromtimestamp(reset_at):%H:%M:%S}' if reset_at else ''))
+		self.platform = platform
+		self.reset_at = reset_at
+
+
+class DeferredError(Exception):
+	"""
+	Raised by the scheduler when a platform isn't able to be posted to right now, and should be tried again later
+
+	Args
+	----
+	- platform: str
+		- The platform that was deferred
+	- until: float
+		- When the platform is able to be posted to again, as a unix timestamp
+	- reason: str
+		- Why the platform was deferred
+	"""
+
+	def __init__(self, platform: str, until: float, reason: str) -> None:
+		super().__init__(f'{platform} was deferred until {datetime.fromtimestamp(until):%H:%M:%S} ({reason})')
+		self.platform = platform
+		self.until = until
+		self.reason = reason
+
+
+def parse_rate_limit(headers) -> tuple:
+	"""
+	Reads the remaining request budget, and when it resets, from a response's rate limit headers
+
+	Every platform names these differently (Twitter uses `x-rate-limit-*` with a unix timestamp,
+	Mastodon uses `x-ratelimit-*` with an ISO 8601 date, and Tumblr has separate hourly and daily
+	limits counted in seconds), so whichever budget is the closest to running out is returned.
+
+	Args
+	----
+	- headers: Mapping
+		- The response headers
+
+	Returns
+	----
+	- Tuple[Optional[int], Optional[float]]
+		- The remaining budget, and when it resets as a unix timestamp (either is None if not present)
+	"""
+
+	headers = {key.lower(): value for key, value in headers.items()}
+	now = time.time()
+	budgets = []
+
+	def parse_reset(value: str, relative: bool) -> Optional[float]:
+		try:
+			return now + float(value) if relative else float(value)
+		except ValueError:
+			pass
+
+		try:
+			return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+		except ValueError:
+			return None
+
+	for prefix, relative in (('x-rate-limit-', False), ('x-ratelimit-', False), ('x-ratelimit-perhour-', True), ('x-ratelimit-perday-', True)):
+		remaining = headers.get(f'{prefix}remaining')
+		if remaining is None or not remaining.isdigit():
+			continue
+
+		reset = headers.get(f'{prefix}reset')
+		budgets.append((int(remaining), parse_reset(reset, relative) if reset else None))
+
+	if 'retry-after' in headers:
+		budgets.append((0, parse_reset(headers['retry-after'], True)))
+
+	if not budgets:
+		return None, None
+
+	return min(budgets, key = lambda budget: budget[0])
+
+
+class PublishScheduler():
+	"""
+	Decides when each platform is able to be posted to, based on its rate limits and recent failures
+
+	Rather than sleeping inside a platform call when it's rate limited (which stalls the whole post
+	cycle), the scheduler keeps track of each platform's remaining budget from its response headers.
+	A rate limit that resets soon is waited out within that platform's own task, and anything further
+	off defers the platform to a later cycle, so the other platforms carry on as normal.
+
+	Failed attempts are retried with jittered exponential backoff. After `failure_threshold` failures
+	in a row, the platform's circuit breaker opens, and it's skipped entirely for `cooldown` seconds,
+	after which a single attempt is let through to see whether it has recovered.
+
+	Args
+	----
+	- max_retries: Optional[int]
+		- The maximum amount of times a publisher is called per attempt
+	- failure_threshold: Optional[int]
+		- The amount of failures in a row that opens a platform's circuit breaker
+	- cooldown: Optional[float]
+		- The amount of seconds a circuit breaker stays open for
+	- max_wait: Optional[float]
+		- The longest rate limit (in seconds) that's waited out, rather than deferring the platform
+	- logger: Optional[Logger]
+		- The logger to report retries, deferrals and circuit breaker changes to
+	"""
+
+	def __init__(
+		self,
+		max_retries: Optional[int] = 3,
+		failure_threshold: Optional[int] = 5,
+		cooldown: Optional[float] = 1800.0,
+		max_wait: Optional[float] = 120.0,
+		logger = None
+	) -> None:
+		self.max_retries = max_retries
+		self.failure_threshold = failure_threshold
+		self.cooldown = cooldown
+		self.max_wait = max_wait
+		self.log = logger
+		self._platforms: dict = {}
+
+	def _state(self, platform: str) -> dict:
+		return self._platforms.setdefault(platform, {
+			'remaining': None,
+			'reset_at': None,
+			'failures': 0,
+			'open_until': 0.0,
+		})
+
+	def observe(self, platform: str, headers) -> None:
+		"""
+		Records a platform's rate limit budget from the headers of one of its responses
+
+		Args
+		----
+		- platform: str
+			- The platform the response came from
+		- headers: Mapping
+			- The response headers
+		"""
+
+		remaining, reset_at = parse_rate_limit(headers)
+		if remaining is None:
+			return
+
+		state = self._state(platform)
+		state['remaining'] = remaining
+		state['reset_at'] = reset_at
+
+	def check_response(self, platform: str, status_code: int, headers) -> None:
+		"""
+		Records a platform's rate limit budget from one of its responses, raising if the request was rate limited
+
+		Args
+		----
+		- platform: str
+			- The platform the response came from
+		- status_code: int
+			- The status code of the response
+		- headers: Mapping
+			- The response headers
+
+		Raises
+		----
+		- RateLimitedError
+			- If the response was a 429
+		"""
+
+		self.observe(platform, headers)
+
+		if status_code == 429:
+			raise RateLimitedError(platform, self._state(platform)['reset_at'])
+
+	def rate_limited_until(self, platform: str) -> float:
+		"""
+		Returns when the platform's rate limit resets, or 0 if it still has budget left
+		"""
+
+		state = self._state(platform)
+		if state['remaining'] == 0 and state['reset_at'] and state['reset_at'] > time.time():
+			return state['reset_at']
+
+		return 0.0
+
+	def circuit_open(self, platform: str) -> bool:
+		"""
+		Whether or not the platform's circuit breaker is open, meaning it shouldn't be posted to at all right now
+		"""
+
+		return self._state(platform)['open_until'] > time.time()
+
+	def record_success(self, platform: str) -> None:
+		state = self._state(platform)
+
+		if state['failures'] >= self.failure_threshold and self.log:
+			self.log.info(f"{platform} has recovered, closing its circuit breaker")
+
+		state['failures'] = 0
+		state['open_until'] = 0.0
+
+	def record_failure(self, platform: str) -> None:
+		state = self._state(platform)
+		state['failures'] += 1
+
+		if state['failures'] >= self.failure_threshold:
+			state['open_until'] = time.time() + self.cooldown
+
+			if self.log:
+				self.log.warning(f"{platform} has failed {state['failures']} times in a row, skipping it for the next {self.cooldown:.0f} seconds")
+
+	async def _wait_for_budget(self, platform: str, reset_at: Optional[float]) -> None:
+		# waits out a rate limit that resets soon, or defers the platform if it's too far off
+		wait = (reset_at or 0) - time.time()
+		if wait <= 0:
+			return
+
+		if wait > self.max_wait:
+			raise DeferredError(platform, reset_at, 'rate limited')
+
+		if self.log:
+			self.log.info(f"{platform} is rate limited, waiting {wait:.0f} seconds for it to reset")
+
+		await asyncio.sleep(wait)
+
+	async def run(self, platform: str, func, *args, **kwargs):
+		"""
+		Calls a publisher, retrying it with backoff if it fails
+
+		Args
+		----
+		- platform: str
+			- The platform being posted to
+		- func: Callable
+			- The publisher, a coroutine function that returns something falsy if it fails
+		- *args, **kwargs
+			- The arguments to call the publisher with
+
+		Returns
+		----
+		- Any
+			- Whatever the publisher returned on its last attempt
+
+		Raises
+		----
+		- DeferredError
+			- If the platform's circuit breaker is open, it's rate limited for longer than `max_wait`, or it's still rate limited once the retries run out
+		"""
+
+		if self.circuit_open(platform):
+			raise DeferredError(platform, self._state(platform)['open_until'], 'circuit breaker open')
+
+		result = False
+
+		for attempt in range(self.max_retries):
+			await self._wait_for_budget(platform, self.rate_limited_until(platform))
+
+			try:
+				result = await func(*args, **kwargs)
+			except RateLimitedError as error:
+				# being rate limited isn't the platform's fault, so it doesn't count towards the circuit breaker
+				state = self._state(platform)
+				state['remaining'] = 0
+				state['reset_at'] = error.reset_at or time.time() + backoff_delay(attempt, initial = 60.0, maximum = 900.0)
+
+				# out of retries while still rate limited, so it's put off until the limit resets rather than counted as a failure
+				if attempt == self.max_retries - 1:
+					raise DeferredError(platform, state['reset_at'], 'rate limited')
+
+				await self._wait_for_budget(platform, state['reset_at'])
+				continue
+			except Exception:
+				if self.log:
+					self.log.error(f"An error occurred while posting to {platform}\n{traceback.format_exc()}")
+
+				result = False
+
+			if result:
+				self.record_success(platform)
+				return result
+
+			self.record_failure(platform)
+			if self.circuit_open(platform) or attempt == self.max_retries - 1:
+				break
+
+			delay = backoff_delay(attempt, initial = 2.0, maximum = 60.0)
+			if self.log:
+				self.log.warning(f"Posting to {platform} failed, retrying in {delay:.1f} seconds...")
+
+			await asyncio.sleep(delay)
+
+		return result
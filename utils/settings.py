@@ -0,0 +1,148 @@
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Mapping
+
+
+# Immutable, typed views of the config file
+# These are rebuilt by `Config.settings` whenever the underlying config changes, so they're safe to read from anywhere
+
+
+@dataclass(frozen = True, slots = True)
+class EmbedColors:
+	success: str
+	error: str
+	info: str
+
+
+@dataclass(frozen = True, slots = True)
+class PostNotifs:
+	enabled: bool
+	webhook: str
+	role_to_ping: str
+
+
+@dataclass(frozen = True, slots = True)
+class MiscNotifs:
+	enabled: bool
+	webhook: str
+
+
+@dataclass(frozen = True, slots = True)
+class DiscordSettings:
+	token: str
+	post_notifs: PostNotifs
+	misc_notifs: MiscNotifs
+	authed_users: frozenset
+	emojis: Mapping[str, str]
+	embed_colors: EmbedColors
+
+
+@dataclass(frozen = True, slots = True)
+class TwitterSettings:
+	enabled: bool
+	consumer_key: str
+	consumer_secret: str
+	access_token: str
+	access_token_secret: str
+	bearer_token: str
+
+
+@dataclass(frozen = True, slots = True)
+class TumblrSettings:
+	enabled: bool
+	consumer_key: str
+	consumer_secret: str
+	oauth_token: str
+	oauth_secret: str
+	blog_name: str
+	use_catbox_url: bool
+
+
+@dataclass(frozen = True, slots = True)
+class MastodonSettings:
+	enabled: bool
+	api_url: str
+	client_id: str
+	client_secret: str
+	access_token: str
+
+
+@dataclass(frozen = True, slots = True)
+class Settings:
+	userhash: str
+	next_post_time: int
+	media_cache_size: int
+	discord: DiscordSettings
+	twitter: TwitterSettings
+	tumblr: TumblrSettings
+	mastodon: MastodonSettings
+
+
+def build_settings(config: dict) -> Settings:
+	"""
+	Builds an immutable settings snapshot from the given config
+
+	Args
+	----
+	- config: dict
+		- The config to build the snapshot from (expected to already be merged with the default config)
+
+	Returns
+	----
+	- Settings
+		- The settings snapshot
+	"""
+
+	discord = config.get('discord', {})
+	twitter = config.get('twitter', {})
+	tumblr = config.get('tumblr', {})
+	mastodon = config.get('mastodon', {})
+
+	return Settings(
+		userhash = config.get('userhash', ''),
+		next_post_time = int(config.get('next_post_time', 0)),
+		media_cache_size = int(config.get('media_cache_size', 200)),
+		discord = DiscordSettings(
+			token = discord.get('token', ''),
+			post_notifs = PostNotifs(
+				enabled = discord.get('post_notifs', {}).get('enabled', False),
+				webhook = discord.get('post_notifs', {}).get('webhook', ''),
+				role_to_ping = discord.get('post_notifs', {}).get('role_to_ping', ''),
+			),
+			misc_notifs = MiscNotifs(
+				enabled = discord.get('misc_notifs', {}).get('enabled', False),
+				webhook = discord.get('misc_notifs', {}).get('webhook', ''),
+			),
+			authed_users = frozenset(discord.get('authed_users', [])),
+			emojis = MappingProxyType(dict(discord.get('emojis', {}))),
+			embed_colors = EmbedColors(
+				success = discord.get('embed_colors', {}).get('success', ''),
+				error = discord.get('embed_colors', {}).get('error', ''),
+				info = discord.get('embed_colors', {}).get('info', ''),
+			),
+		),
+		twitter = TwitterSettings(
+			enabled = twitter.get('enabled', False),
+			consumer_key = twitter.get('consumer_key', ''),
+			consumer_secret = twitter.get('consumer_secret', ''),
+			access_token = twitter.get('access_token', ''),
+			access_token_secret = twitter.get('access_token_secret', ''),
+			bearer_token = twitter.get('bearer_token', ''),
+		),
+		tumblr = TumblrSettings(
+			enabled = tumblr.get('enabled', False),
+			consumer_key = tumblr.get('consumer_key', ''),
+			consumer_secret = tumblr.get('consumer_secret', ''),
+			oauth_token = tumblr.get('oauth_token', ''),
+			oauth_secret = tumblr.get('oauth_secret', ''),
+			blog_name = tumblr.get('blog_name', ''),
+			use_catbox_url = tumblr.get('use_catbox_url', False),
+		),
+		mastodon = MastodonSettings(
+			enabled = mastodon.get('enabled', False),
+			api_url = mastodon.get('api_url', ''),
+			client_id = mastodon.get('client_id', ''),
+			client_secret = mastodon.get('client_secret', ''),
+			access_token = mastodon.get('access_token', ''),
+		),
+	)